@@ -13,13 +13,45 @@
 # OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
 # PERFORMANCE OF THIS SOFTWARE.
 
-from sys import argv, exit
-from tivopy.tivopy import TiVoPy
-import tivopy.assets
-from PySide2.QtWidgets import QApplication
+from sys import argv, exit, stderr
+
+# Only what's needed to talk to a running instance is imported up front, so
+# that forwarding a command doesn't pay for loading PySide2.
+from tivopy.groups import parse_macro
+from tivopy.instance import forward
+
+def send(macros):
+    """Forwards commands to the running instance of TiVoPy."""
+    for macro in macros:
+        for command in parse_macro(macro):
+            reply = forward({ "command" : command })
+
+            if reply is None:
+                print("TiVoPy isn't running.", file=stderr)
+                return 1
+
+            if not reply["ok"]:
+                print(f"{command}: {reply['error']}", file=stderr)
+                return 1
+
+    return 0
 
 if __name__ == '__main__':
+    if argv[1:2] == ["send"]:
+        exit(send(argv[2:]))
+
+    # Only one instance runs at a time; starting another brings the first to
+    # the front instead.
+    if forward({ "show" : True }) is not None:
+        exit(0)
+
+    from tivopy.tivopy import TiVoPy
+    import tivopy.assets
+    from PySide2.QtWidgets import QApplication
+
     app = QApplication(argv)
 
     tivopy = TiVoPy()
+    app.aboutToQuit.connect(tivopy.close)
+
     exit(app.exec_())
@@ -0,0 +1,726 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""
+Headless command line interface, run with `python -m tivopy`.
+
+Nothing in here may import PySide2, and modules are only imported by the
+commands that need them: the one-shot commands are meant to be cheap enough
+to run from shell loops and cron. Pass --timing to see what starting up
+cost.
+"""
+
+from time import perf_counter
+
+# Taken as early as possible, everything before this is the interpreter
+# itself starting up.
+STARTED = perf_counter()
+
+import argparse
+import sys
+
+def print_result(result):
+    status = "ok" if result.ok else "FAILED"
+
+    print(f"{result.device.name} ({result.device.key}): {status} "
+          f"{result.detail} [{result.elapsed * 1000:.0f} ms]")
+
+def pool_options(args):
+    """Returns the ConnectionPool settings given on the command line."""
+    from .pool import Timeouts
+
+    timeouts = Timeouts(args.connect_timeout or args.timeout,
+                        args.send_timeout or args.timeout,
+                        args.ack_timeout or args.timeout)
+
+    return { "timeouts"          : timeouts,
+             "failure_threshold" : args.failure_threshold,
+             "reset_timeout"     : args.reset_timeout }
+
+def print_breakers(pool_states):
+    """Reports every circuit breaker that isn't closed."""
+    for key, state in sorted(pool_states.items()):
+        if state["state"] != "closed":
+            print(f"breaker {key}: {state['state']} after "
+                  f"{state['failures']} failure(s)", file=sys.stderr)
+
+def send_commands(args, commands):
+    """
+    Sends commands to the TiVo given with --tivo or, without it, through the
+    running instance of TiVoPy.
+    """
+    # The protocol is ASCII only, anything else can't even be sent.
+    for command in commands:
+        if not command.isascii():
+            print(f"Invalid command: {command}", file=sys.stderr)
+            return 2
+
+    if not args.tivo:
+        from .instance import forward
+
+        for command in commands:
+            reply = forward({ "command" : command })
+
+            if reply is None:
+                print("TiVoPy isn't running, use --tivo to say which TiVo "
+                      "to send to", file=sys.stderr)
+                return 1
+
+            if not reply["ok"]:
+                print(f"{command}: {reply['error']}", file=sys.stderr)
+                return 1
+
+        return 0
+
+    import asyncio
+    from .aio_client import AsyncTiVoClient, TiVoError
+    from .capabilities import CapabilityCache
+    from .fleet import execute
+    from .inventory import Inventory, find_device
+
+    try:
+        device = find_device(args.tivo, Inventory(args.inventory))
+    except ValueError:
+        print(f"Invalid TiVo: {args.tivo}", file=sys.stderr)
+        return 2
+
+    async def send_to():
+        client = AsyncTiVoClient(device.address,
+                                 device.port,
+                                 capabilities=CapabilityCache().get(
+                                     device.address),
+                                 send_timeout=args.timeout)
+        try:
+            await client.connect(args.timeout)
+            return await execute(client, commands, args.timeout)
+        finally:
+            await client.close()
+
+    try:
+        detail = asyncio.run(send_to())
+    except TiVoError as e:
+        print(f"{device.key}: {e.code}", file=sys.stderr)
+        return 1
+    except (OSError, asyncio.TimeoutError) as e:
+        print(f"{device.key}: {str(e) or 'TIMEOUT'}", file=sys.stderr)
+        return 1
+
+    print(detail)
+    return 0
+
+def send(args):
+    """Sends a command or macro to a single TiVo."""
+    from .groups import parse_macro
+
+    return send_commands(args, parse_macro(" ".join(args.macro)))
+
+def setch(args):
+    """Changes the channel of a single TiVo."""
+    command = "FORCECH" if args.force else "SETCH"
+
+    return send_commands(args, [f"{command} {args.channel}"])
+
+def discover(args):
+    """Lists the TiVos on the local network."""
+    from time import sleep
+    from .discovery_service import open_discovery
+    from .inventory import Inventory
+    from .tivo_discovery import START_ERRORS, TiVoDiscovery
+
+    inventory = Inventory(args.inventory)
+    interfaces = args.interface or None
+
+    try:
+        if args.no_service:
+            discovery = TiVoDiscovery(interfaces=interfaces)
+        else:
+            discovery = open_discovery(interfaces)
+    except START_ERRORS as e:
+        print(f"Unable to look for TiVos: {e}", file=sys.stderr)
+        return 1
+
+    for network in args.scan:
+        try:
+            discovery.scan(network)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            discovery.close()
+            return 2
+    start = perf_counter()
+    version = 0
+    listed = set()
+
+    try:
+        while perf_counter() - start < args.timeout:
+            snapshot = discovery.registry.snapshot
+
+            if snapshot.version != version:
+                version = snapshot.version
+
+                # TiVos remembered from the last run are only listed once
+                # they've been confirmed to still be there.
+                for name, address in snapshot.listings(verified=True):
+                    if (name, address) in listed:
+                        continue
+
+                    print(f"{name}\t{address}\t"
+                          f"[{(perf_counter() - start) * 1000:.0f} ms]")
+                    inventory.remember(name, address)
+                    listed.add((name, address))
+
+            sleep(0.05)
+    finally:
+        discovery.close()
+
+    return 0
+
+def select_devices(args):
+    """Returns the TiVos in the inventory matching --tag, --model, etc."""
+    from .inventory import Inventory
+
+    return Inventory(args.inventory).query(args.tags,
+                                           args.model,
+                                           args.location)
+
+def print_device(device):
+    details = [device.key, device.origin]
+
+    if device.model:
+        details.append(device.model)
+
+    if device.location:
+        details.append(f"at {device.location}")
+
+    if device.tags:
+        details.append("tagged " + ", ".join(sorted(device.tags)))
+
+    print(f"{device.name} ({'; '.join(details)})")
+
+def inventory(args):
+    """Lists or changes the TiVos in the inventory."""
+    from .inventory import STATIC, Device, Inventory
+
+    inventory = Inventory(args.inventory)
+
+    if args.action == "list":
+        for device in inventory.query(args.tags, args.model, args.location,
+                                      args.origin):
+            print_device(device)
+
+        return 0
+
+    if args.action == "add":
+        device = Device(args.name,
+                        args.address,
+                        args.port,
+                        model=args.model,
+                        tags=args.tags,
+                        location=args.location,
+                        origin=STATIC)
+        inventory.add(device)
+    else:
+        device = inventory.get(args.tivo)
+
+        if device is None:
+            print(f"{args.tivo} isn't in the inventory", file=sys.stderr)
+            return 1
+
+        if args.action == "remove":
+            inventory.remove(device)
+        elif args.action == "tag":
+            inventory.update(device, tags=device.tags | set(args.tags))
+        elif args.action == "untag":
+            inventory.update(device, tags=device.tags - set(args.tags))
+        elif args.action == "locate":
+            inventory.update(device, location=args.location or None)
+
+    inventory.save()
+    return 0
+
+def snapshot(args):
+    """Saves the channel of every known TiVo."""
+    import asyncio
+    from .fleet import snapshot
+
+    summary = asyncio.run(snapshot(select_devices(args),
+                                   args.file,
+                                   args.concurrency,
+                                   args.timeout,
+                                   print_result))
+    print(summary)
+
+    return 0 if not summary.failed else 1
+
+def restore(args):
+    """Tunes every TiVo in a snapshot back into its channel."""
+    import asyncio
+    from .fleet import restore
+
+    try:
+        summary = asyncio.run(restore(args.file,
+                                      args.concurrency,
+                                      args.timeout,
+                                      print_result))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    print(summary)
+
+    return 0 if not summary.failed else 1
+
+def run(args):
+    """Sends a command or macro to every TiVo, over several processes."""
+    from .fleet_runner import FleetRunner
+    from .groups import parse_macro
+
+    devices = select_devices(args)
+    commands = parse_macro(" ".join(args.macro))
+
+    with FleetRunner(args.workers,
+                     args.concurrency,
+                     **pool_options(args)) as runner:
+        summary = runner.run(devices,
+                             commands,
+                             print_result if args.verbose else None)
+
+    print(summary)
+    print("latency p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms, "
+          "max {:.1f} ms".format(*summary.latencies()))
+    print(f"{len(devices) / summary.elapsed:.0f} TiVo(s) per second")
+    print(runner.describe_metrics())
+
+    return 0 if not summary.failed else 1
+
+def jobs(args):
+    """Runs a stream of JSON lines jobs."""
+    import asyncio
+    from .inventory import Inventory
+    from .jobs import JobRunner
+    from .pool import ConnectionPool
+
+    devices = Inventory(args.inventory)
+
+    async def run_jobs(stream):
+        pool = ConnectionPool(**pool_options(args))
+        runner = JobRunner(pool,
+                           sys.stdout,
+                           args.max_in_flight,
+                           args.per_device,
+                           args.timeout,
+                           devices)
+        try:
+            await runner.run(stream)
+        finally:
+            await pool.close()
+
+        print_breakers(pool.breaker_states())
+
+        return runner
+
+    if args.file and args.file != "-":
+        with open(args.file, 'r', encoding='utf-8') as stream:
+            runner = asyncio.run(run_jobs(stream))
+    else:
+        runner = asyncio.run(run_jobs(sys.stdin))
+
+    print(f"{runner.succeeded} job(s) succeeded, {runner.failed} failed",
+          file=sys.stderr)
+
+    return 0 if not runner.failed else 1
+
+def gateway(args):
+    """Serves the HTTP and WebSocket gateway until interrupted."""
+    import asyncio
+    from .gateway import Gateway
+    from .inventory import Inventory
+    from .pool import ConnectionPool
+
+    async def serve():
+        gateway = Gateway(ConnectionPool(**pool_options(args)),
+                          Inventory(args.inventory),
+                          args.max_in_flight,
+                          args.client_rate,
+                          args.client_burst,
+                          any_device=args.any_device)
+        server = await gateway.start(args.host, args.port)
+
+        print(f"Listening on {args.host}:{args.port}", file=sys.stderr)
+
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+def proxy(args):
+    """Shares one connection to each TiVo between local clients."""
+    import asyncio
+    from .inventory import Inventory, find_device
+    from .proxy import MultiplexProxy
+
+    devices = Inventory(args.inventory)
+    mappings = []
+
+    for mapping in args.mappings:
+        port, _, device = mapping.partition("=")
+
+        if not port.isdigit() or not device:
+            print(f"Invalid mapping {mapping}, expected PORT=TIVO",
+                  file=sys.stderr)
+            return 2
+
+        mappings.append((int(port), find_device(device, devices)))
+
+    async def serve():
+        proxies = [MultiplexProxy(device, args.queue_size)
+                   for port, device in mappings]
+
+        for (port, device), multiplexer in zip(mappings, proxies):
+            await multiplexer.start(args.host, port)
+
+            print(f"Forwarding {args.host}:{port} to {device.name} "
+                  f"({device.key})", file=sys.stderr)
+
+        try:
+            await asyncio.Event().wait()
+        finally:
+            for multiplexer in proxies:
+                await multiplexer.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+def discovery_service(args):
+    """Discovers TiVos on behalf of every other TiVoPy process."""
+    import asyncio
+    from .discovery_service import DiscoveryService
+
+    service = DiscoveryService(args.interface or None, args.idle_timeout)
+
+    try:
+        return asyncio.run(service.run())
+    except KeyboardInterrupt:
+        return 0
+
+def simulate(args):
+    """Serves simulated TiVos until interrupted."""
+    import asyncio
+    from .simulator import VirtualFleet, parse_profiles
+
+    try:
+        profiles = parse_profiles(args.profiles)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    async def serve():
+        fleet = VirtualFleet(args.count,
+                             profiles,
+                             args.base_port,
+                             args.spread,
+                             args.seed)
+        await fleet.start()
+        fleet.write_inventory(args.inventory)
+
+        print(f"{args.count} simulated TiVo(s) listening, inventory written "
+              f"to {args.inventory}", file=sys.stderr)
+
+        loop = asyncio.get_event_loop()
+        end = loop.time() + args.duration if args.duration else None
+
+        try:
+            while end is None or loop.time() < end:
+                await asyncio.sleep(args.interval if end is None else
+                                    min(args.interval, end - loop.time()))
+                print(fleet.report(), file=sys.stderr)
+        finally:
+            fleet.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+def report_timing(parsed):
+    """Describes what the command cost, for keeping cold starts cheap."""
+    finished = perf_counter()
+    gui = "loaded" if "PySide2" in sys.modules else "not loaded"
+
+    print(f"startup {(parsed - STARTED) * 1000:.1f} ms, "
+          f"command {(finished - parsed) * 1000:.1f} ms, "
+          f"{len(sys.modules)} modules, PySide2 {gui}", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="tivopy",
+                                     description="TiVo Virtual Remote "
+                                                 "Control")
+    parser.add_argument("--timing", action="store_true",
+                        help="report how long starting up took")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    fleet = argparse.ArgumentParser(add_help=False)
+    fleet.add_argument("--concurrency", type=int, default=16,
+                       help="maximum number of TiVos to talk to at once")
+    fleet.add_argument("--timeout", type=float, default=5.0,
+                       help="seconds to wait for each TiVo")
+
+    # Settings of the persistent connections used by "run" and "jobs".
+    pool = argparse.ArgumentParser(add_help=False)
+    pool.add_argument("--connect-timeout", type=float,
+                      help="seconds to wait for a connection to open "
+                           "(default: --timeout)")
+    pool.add_argument("--send-timeout", type=float,
+                      help="seconds to wait for a command to be sent "
+                           "(default: --timeout)")
+    pool.add_argument("--ack-timeout", type=float,
+                      help="seconds to wait for a channel change to be "
+                           "confirmed (default: --timeout)")
+    pool.add_argument("--failure-threshold", type=int, default=3,
+                      help="consecutive failures before a TiVo is failed "
+                           "fast")
+    pool.add_argument("--reset-timeout", type=float, default=30.0,
+                      help="seconds before a failed TiVo is tried again")
+
+    # Settings of the one-shot commands aimed at a single TiVo.
+    single = argparse.ArgumentParser(add_help=False)
+    single.add_argument("--tivo",
+                        help="name, address or address:port of the TiVo "
+                             "(default: the one the running TiVoPy is "
+                             "connected to)")
+    single.add_argument("--inventory",
+                        help="inventory file to resolve TiVo names with")
+    single.add_argument("--timeout", type=float, default=5.0,
+                        help="seconds to wait for the TiVo")
+
+    command = commands.add_parser("send", parents=[single],
+                                  help="send a command or macro to a TiVo")
+    command.add_argument("macro", nargs="+",
+                         help="command, or commands separated by semicolons")
+    command.set_defaults(handler=send)
+
+    command = commands.add_parser("setch", parents=[single],
+                                  help="change the channel of a TiVo")
+    command.add_argument("channel")
+    command.add_argument("--force", action="store_true",
+                         help="stop a recording in progress if necessary")
+    command.set_defaults(handler=setch)
+
+    command = commands.add_parser("discover",
+                                  help="list the TiVos on the local network")
+    command.add_argument("--timeout", type=float, default=3.0,
+                         help="seconds to listen for TiVos")
+    command.add_argument("--inventory",
+                         help="inventory file to add the TiVos found to")
+    command.add_argument("--scan", action="append", default=[],
+                         metavar="NETWORK",
+                         help="also scan a network such as 192.168.1.0/24 "
+                              "for TiVos, may be given more than once")
+    command.add_argument("--interface", action="append", default=[],
+                         help="name or address of a network interface to "
+                              "look for TiVos on, may be given more than "
+                              "once; all of them by default")
+    command.add_argument("--no-service", action="store_true",
+                         help="look for TiVos from this process, rather "
+                              "than through the shared discovery service")
+    command.set_defaults(handler=discover)
+
+    inventory_file = argparse.ArgumentParser(add_help=False)
+    inventory_file.add_argument("--inventory",
+                                help="inventory file to read TiVos from")
+
+    # Picks out part of the inventory.
+    targets = argparse.ArgumentParser(add_help=False,
+                                      parents=[inventory_file])
+    targets.add_argument("--tag", dest="tags", action="append", default=[],
+                         help="only TiVos with this tag, may be given more "
+                              "than once")
+    targets.add_argument("--model", help="only TiVos of this model")
+    targets.add_argument("--location", help="only TiVos at this location")
+
+    command = commands.add_parser("inventory",
+                                  help="list or change the known TiVos")
+    actions = command.add_subparsers(dest="action")
+    actions.required = True
+
+    action = actions.add_parser("list", parents=[targets],
+                                help="list the TiVos")
+    action.add_argument("--origin", choices=("discovered", "static"),
+                        help="only TiVos that were discovered, or added by "
+                             "hand")
+
+    action = actions.add_parser("add", parents=[inventory_file],
+                                help="add a TiVo by hand")
+    action.add_argument("name")
+    action.add_argument("address")
+    action.add_argument("--port", type=int, default=31339)
+    action.add_argument("--model")
+    action.add_argument("--tag", dest="tags", action="append", default=[])
+    action.add_argument("--location")
+
+    action = actions.add_parser("remove", parents=[inventory_file],
+                                help="forget a TiVo")
+    action.add_argument("tivo", help="id, name or key of the TiVo")
+
+    for name, help_text in (("tag", "tag a TiVo"),
+                            ("untag", "remove tags from a TiVo")):
+        action = actions.add_parser(name, parents=[inventory_file],
+                                    help=help_text)
+        action.add_argument("tivo", help="id, name or key of the TiVo")
+        action.add_argument("tags", nargs="+", metavar="tag")
+
+    action = actions.add_parser("locate", parents=[inventory_file],
+                                help="set where a TiVo is")
+    action.add_argument("tivo", help="id, name or key of the TiVo")
+    action.add_argument("location", help="location, empty to clear it")
+
+    command.set_defaults(handler=inventory)
+
+    command = commands.add_parser("snapshot", parents=[fleet, targets],
+                                  help="save the channel of every known TiVo")
+    command.add_argument("file")
+    command.set_defaults(handler=snapshot)
+
+    command = commands.add_parser("restore", parents=[fleet],
+                                  help="restore the channels in a snapshot")
+    command.add_argument("file")
+    command.set_defaults(handler=restore)
+
+    command = commands.add_parser("run", parents=[fleet, pool, targets],
+                                  help="send a command or macro to every "
+                                       "known TiVo using several processes")
+    command.add_argument("macro", nargs="+",
+                         help="command, or commands separated by semicolons")
+    command.add_argument("--workers", type=int,
+                         help="number of worker processes (default: one per "
+                              "CPU core)")
+    command.add_argument("--verbose", action="store_true",
+                         help="print the result of every TiVo")
+    command.set_defaults(handler=run, concurrency=256)
+
+    command = commands.add_parser("jobs", parents=[pool],
+                                  help="run JSON lines jobs from a file or "
+                                       "standard input")
+    command.add_argument("file", nargs="?",
+                         help="file to read jobs from (default: standard "
+                              "input)")
+    command.add_argument("--inventory",
+                         help="inventory file to resolve TiVo names with")
+    command.add_argument("--max-in-flight", type=int, default=256,
+                         help="maximum number of unfinished jobs")
+    command.add_argument("--per-device", type=int, default=1,
+                         help="maximum number of unfinished jobs per TiVo")
+    command.add_argument("--timeout", type=float, default=5.0,
+                         help="the longest a single job may take, in "
+                              "seconds")
+    command.set_defaults(handler=jobs)
+
+    command = commands.add_parser("gateway", parents=[pool],
+                                  help="serve an HTTP and WebSocket API")
+    command.add_argument("--host", default="127.0.0.1",
+                         help="address to listen on")
+    command.add_argument("--port", type=int, default=8339,
+                         help="port to listen on")
+    command.add_argument("--inventory",
+                         help="inventory file to resolve TiVo names with")
+    command.add_argument("--any-device", action="store_true",
+                         help="drive TiVos that aren't in the inventory too")
+    command.add_argument("--max-in-flight", type=int, default=256,
+                         help="requests to TiVos beyond this many at once "
+                              "are refused")
+    command.add_argument("--client-rate", type=float, default=20.0,
+                         help="requests per second allowed per client")
+    command.add_argument("--client-burst", type=int, default=40,
+                         help="requests a client may make in a burst")
+    command.add_argument("--timeout", type=float, default=5.0,
+                         help="seconds to wait for each TiVo")
+    command.set_defaults(handler=gateway)
+
+    command = commands.add_parser("proxy",
+                                  help="share one connection to each TiVo "
+                                       "between any number of clients")
+    command.add_argument("mappings", nargs="+", metavar="PORT=TIVO",
+                         help="local port to listen on, and the TiVo it "
+                              "forwards to")
+    command.add_argument("--host", default="127.0.0.1",
+                         help="address to listen on")
+    command.add_argument("--inventory",
+                         help="inventory file to resolve TiVo names with")
+    command.add_argument("--queue-size", type=int, default=64,
+                         help="commands each client may have waiting to be "
+                              "sent")
+    command.set_defaults(handler=proxy)
+
+    command = commands.add_parser("discovery-service",
+                                  help="discover TiVos on behalf of every "
+                                       "other TiVoPy process, started "
+                                       "automatically when needed")
+    command.add_argument("--interface", action="append", default=[],
+                         help="name or address of a network interface to "
+                              "look for TiVos on, may be given more than "
+                              "once; all of them by default")
+    command.add_argument("--idle-timeout", type=float, default=60.0,
+                         help="seconds to keep running without any "
+                              "subscribers")
+    command.set_defaults(handler=discovery_service)
+
+    command = commands.add_parser("simulate",
+                                  help="serve simulated TiVos for load "
+                                       "testing")
+    command.add_argument("count", type=int,
+                         help="number of TiVos to simulate")
+    command.add_argument("inventory",
+                         help="inventory file to write the simulated TiVos "
+                              "to")
+    command.add_argument("--profiles", default="lan",
+                         help="mix of latency profiles, such as "
+                              "lan:80,wifi:15,slow:4,flaky:1")
+    command.add_argument("--spread", choices=("ports", "addresses"),
+                         default="ports",
+                         help="give each TiVo its own loopback port, or its "
+                              "own loopback address (Linux only)")
+    command.add_argument("--base-port", type=int,
+                         help="first port to listen on (default: 41000, or "
+                              "31339 with --spread addresses)")
+    command.add_argument("--seed", type=int,
+                         help="seed, to simulate the same fleet every time")
+    command.add_argument("--interval", type=float, default=5.0,
+                         help="seconds between reports")
+    command.add_argument("--duration", type=float,
+                         help="seconds to run for (default: until "
+                              "interrupted)")
+    command.set_defaults(handler=simulate)
+
+    args = parser.parse_args(argv)
+    parsed = perf_counter()
+
+    try:
+        return args.handler(args)
+    finally:
+        if args.timing:
+            report_timing(parsed)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+import asyncio
+
+from .capabilities import Capabilities
+from .device_state import DeviceState
+from .protocol import (PORT,
+                       LineBuffer,
+                       encode_command,
+                       normalize_channel,
+                       parse_response)
+
+# TiVoError codes that mean the connection itself is in trouble, as opposed to
+# the TiVo refusing a command.
+CONNECTION_ERRORS = ("TIMEOUT", "CONNECTION_CLOSED", "NOT_CONNECTED")
+
+class TiVoError(Exception):
+    """Raised when a TiVo rejects a command, or a command can't be sent."""
+    def __init__(self, code, address=None):
+        super(TiVoError, self).__init__(code)
+
+        # The error code, i.e. "NO_LIVE" or "UNSUPPORTED_COMMAND".
+        self.code = code
+        self.address = address
+
+class AsyncTiVoClient:
+    """
+    Implements the TiVo version 1.1 TCP Remote Protocol on top of asyncio.
+
+    This is the headless counterpart of `TiVoClient` and shares its device
+    state and capability handling, but never imports PySide2.
+    """
+    def __init__(self, address, port=PORT, state=None, capabilities=None,
+                 send_timeout=None):
+        self.address = address
+        self.port = port
+
+        # How long a command may take to be handed to the operating system.
+        # Writes only ever wait if the TiVo has stopped reading.
+        self.send_timeout = send_timeout
+
+        self.state = state if state is not None else DeviceState(address)
+
+        if capabilities is None:
+            capabilities = Capabilities()
+
+        self.capabilities = capabilities
+
+        self.reader = None
+        self.writer = None
+        self.read_task = None
+
+        # Coroutines waiting for a particular response, as a list of
+        # (predicate, future).
+        self.waiters = []
+
+        # Callables invoked as listener(client, response) for every response
+        # received.
+        self.listeners = []
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self, timeout=None):
+        """Opens the connection to the TiVo."""
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.address, self.port), timeout)
+
+        self.read_task = asyncio.ensure_future(self.read_loop())
+
+    async def close(self):
+        """Closes the connection to the TiVo."""
+        if self.read_task:
+            self.read_task.cancel()
+            self.read_task = None
+
+        if self.writer:
+            self.writer.close()
+
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+
+        self.fail_waiters(TiVoError("CONNECTION_CLOSED", self.address))
+
+    async def read_loop(self):
+        """Handles data received from the TiVo until the connection ends."""
+        lines = LineBuffer()
+
+        try:
+            while True:
+                data = await self.reader.read(4096)
+
+                if not data:
+                    break
+
+                for line in lines.feed(data):
+                    self.handle_response(parse_response(line))
+        except OSError:
+            pass
+        finally:
+            self.writer.close()
+            self.fail_waiters(TiVoError("CONNECTION_CLOSED", self.address))
+
+    def handle_response(self, response):
+        """Called with every response received from the TiVo."""
+        self.state.update(response)
+
+        for listener in list(self.listeners):
+            listener(self, response)
+
+        for waiter in list(self.waiters):
+            predicate, future = waiter
+
+            if future.done():
+                self.waiters.remove(waiter)
+            elif predicate(response):
+                self.waiters.remove(waiter)
+                future.set_result(response)
+
+    def fail_waiters(self, error):
+        """Wakes everybody waiting for a response with `error`."""
+        waiters, self.waiters = self.waiters, []
+
+        for predicate, future in waiters:
+            if not future.done():
+                future.set_exception(error)
+
+    def expect(self, predicate):
+        """
+        Returns a future resolved with the first response that matches
+        `predicate`. This must be called *before* the command that causes the
+        response is sent.
+        """
+        future = asyncio.get_event_loop().create_future()
+        self.waiters.append((predicate, future))
+
+        return future
+
+    async def wait_for(self, future, timeout=None):
+        """Waits for a future returned by `expect()`."""
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TiVoError("TIMEOUT", self.address)
+
+    async def send_command(self, command):
+        """
+        Sends a command to the TiVo. Returns False if the command wasn't
+        sent because it wouldn't have changed anything.
+        """
+        translated = self.capabilities.translate(command)
+
+        if translated is None:
+            raise TiVoError("UNSUPPORTED_COMMAND", self.address)
+
+        if self.state.is_redundant(translated):
+            return False
+
+        if not self.connected:
+            raise TiVoError("NOT_CONNECTED", self.address)
+
+        self.writer.write(encode_command(translated))
+
+        try:
+            await asyncio.wait_for(self.writer.drain(), self.send_timeout)
+        except asyncio.TimeoutError:
+            raise TiVoError("TIMEOUT", self.address)
+
+        self.state.observe_command(translated)
+        return True
+
+    async def status(self, timeout=None):
+        """
+        Returns the state of the TiVo once its channel is known. The TiVo
+        reports its channel as soon as we connect.
+        """
+        if self.state.channel is None:
+            future = self.expect(lambda r: r.kind == "CH_STATUS")
+            await self.wait_for(future, timeout)
+
+        return self.state
+
+    async def set_channel(self, channel, subchannel=None, force=False,
+                          timeout=None):
+        """
+        Changes the channel and waits for the TiVo to confirm it. Raises
+        TiVoError if the TiVo refuses.
+        """
+        command = "FORCECH" if force else "SETCH"
+        command = f"{command} {channel}"
+
+        if subchannel:
+            command += f" {subchannel}"
+
+        channel = normalize_channel(channel)
+        subchannel = normalize_channel(subchannel)
+
+        future = self.expect(
+            lambda r: r.kind == "CH_FAILED" or
+                      (r.kind == "CH_STATUS" and
+                       normalize_channel(r.channel) == channel and
+                       normalize_channel(r.subchannel) == subchannel))
+
+        if not await self.send_command(command):
+            future.cancel()
+            return self.state
+
+        response = await self.wait_for(future, timeout)
+
+        if response.kind == "CH_FAILED":
+            raise TiVoError(response.reason, self.address)
+
+        return self.state
@@ -0,0 +1,90 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+from time import monotonic
+
+# Requests go through as normal.
+CLOSED = "closed"
+
+# The TiVo has failed too often; requests fail immediately.
+OPEN = "open"
+
+# The TiVo has been left alone long enough; a single request is let through
+# to find out whether it has recovered.
+HALF_OPEN = "half-open"
+
+class CircuitBreaker:
+    """Stops a TiVo that isn't responding from holding everything else up."""
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        # Consecutive failures that open the breaker.
+        self.failure_threshold = failure_threshold
+
+        # Seconds to wait before letting a trial request through.
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.opened_at = None
+
+        # Whether the trial request of the half-open state is in progress.
+        self.trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return CLOSED
+
+        if monotonic() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+
+        return OPEN
+
+    def allow(self):
+        """Returns True if a request to the TiVo may go ahead."""
+        state = self.state
+
+        if state == CLOSED:
+            return True
+
+        if state == HALF_OPEN and not self.trial:
+            self.trial = True
+            return True
+
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def record_failure(self):
+        self.failures += 1
+
+        # A failed trial reopens the breaker straight away.
+        if self.trial or self.failures >= self.failure_threshold:
+            self.opened_at = monotonic()
+
+        self.trial = False
+
+    def to_dict(self):
+        """Describes the breaker, for monitoring."""
+        state = self.state
+        retry_in = None
+
+        if state == OPEN:
+            retry_in = round(self.reset_timeout -
+                             (monotonic() - self.opened_at), 3)
+
+        return { "state"    : state,
+                 "failures" : self.failures,
+                 "retry_in" : retry_in }
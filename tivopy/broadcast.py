@@ -0,0 +1,150 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+from time import perf_counter
+
+from PySide2.QtCore import QObject, QTimer, Signal
+
+from .tivo_client import TiVoClient
+
+class BroadcastReport:
+    """The outcome of sending a command or macro to a group of TiVos."""
+    def __init__(self, addresses):
+        # IP address to a short description of what happened, i.e. "sent",
+        # "channel 702" or "error NO_LIVE".
+        self.results = { address : "not sent" for address in addresses }
+
+        # The largest difference between the first and last TiVo being
+        # written to, over every command, in milliseconds.
+        self.skew = 0.0
+
+    @property
+    def failures(self):
+        return { address : result
+                 for address, result in self.results.items()
+                 if result.startswith("error") or result == "not sent" }
+
+    def __str__(self):
+        lines = [f"{len(self.results) - len(self.failures)} of "
+                 f"{len(self.results)} TiVo(s) succeeded, "
+                 f"send skew {self.skew:.2f} ms"]
+
+        for address, result in sorted(self.failures.items()):
+            lines.append(f"{address}: {result}")
+
+        return "\n".join(lines)
+
+class Broadcast(QObject):
+    """
+    Sends commands to groups of TiVos at once.
+
+    A connection to each TiVo is opened the first time it's used and kept
+    open, so a broadcast costs nothing but a single write per TiVo.
+    """
+    # Emitted with a BroadcastReport once the results are in.
+    finished = Signal(object)
+
+    # How long to collect responses after the last command was sent, in
+    # milliseconds.
+    RESULT_WINDOW = 1000
+
+    def __init__(self, device_states, capabilities):
+        super(Broadcast, self).__init__()
+
+        self.device_states = device_states
+        self.capabilities = capabilities
+
+        # IP address to TiVoClient.
+        self.clients = {}
+
+        # The report of the broadcast currently collecting results.
+        self.report = None
+
+    def client(self, address):
+        """Returns the persistent client for a TiVo."""
+        client = self.clients.get(address)
+
+        if client is None:
+            client = TiVoClient(address,
+                                self.device_states.get(address),
+                                self.capabilities.get(address))
+            client.stay_connected()
+
+            client.channel_changed.connect(
+                lambda channel, address=address:
+                    self.record(address, f"channel {channel}"))
+            client.error_message.connect(
+                lambda error, address=address:
+                    self.record(address, f"error {error}"))
+            client.connection_error.connect(
+                lambda error, address=address:
+                    self.record(address, "error CONNECTION"))
+
+            self.clients[address] = client
+
+        return client
+
+    def record(self, address, result):
+        """Records a response from a TiVo while collecting results."""
+        if self.report and address in self.report.results:
+            self.report.results[address] = result
+
+    def connect_to(self, addresses):
+        """Opens connections ahead of time, so the first send is fast."""
+        for address in addresses:
+            self.client(address)
+
+    def send(self, addresses, commands):
+        """
+        Sends every command to every TiVo. A macro is sent one command at a
+        time, each command reaching the whole group before the next one.
+        """
+        clients = [(address, self.client(address)) for address in addresses]
+
+        self.report = report = BroadcastReport(addresses)
+
+        for command in commands:
+            times = []
+
+            # Nothing in this loop may wait on the network; each write goes
+            # straight to the kernel so the TiVos receive it back to back.
+            for address, client in clients:
+                if client.send_command(command):
+                    client.socket.flush()
+                    times.append(perf_counter())
+
+                    if report.results[address] == "not sent":
+                        report.results[address] = "sent"
+                elif report.results[address] == "not sent":
+                    report.results[address] = "skipped"
+
+            if len(times) > 1:
+                report.skew = max(report.skew,
+                                  (times[-1] - times[0]) * 1000)
+
+        QTimer.singleShot(self.RESULT_WINDOW,
+                          lambda: self.finish(report))
+
+    def finish(self, report):
+        if self.report is report:
+            self.report = None
+
+        self.finished.emit(report)
+
+    def close(self):
+        """Closes every connection."""
+        for client in self.clients.values():
+            client.close()
+
+        self.clients.clear()
@@ -0,0 +1,180 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+from .config import cache_path, load_json, save_json
+
+# Every optional part of the protocol. IRCODE and SETCH have been around since
+# the very first version and are always assumed to work.
+FEATURES = ("KEYBOARD",
+            "FORCECH",
+            "TELEPORT TIVO",
+            "TELEPORT LIVETV",
+            "TELEPORT GUIDE",
+            "TELEPORT NOWPLAYING")
+
+# Commands that can be expressed with an older part of the protocol if the
+# TiVo doesn't support them. Anything not listed here is rejected instead.
+REWRITES = { "TELEPORT TIVO"            : "IRCODE TIVO",
+             "TELEPORT LIVETV"          : "IRCODE LIVETV",
+             "TELEPORT GUIDE"           : "IRCODE GUIDE",
+             "TELEPORT NOWPLAYING"      : "IRCODE NOWSHOWING",
+             "KEYBOARD VIDEO_ON_DEMAND" : "IRCODE VIDEO_ON_DEMAND" }
+
+# Models, by the first 3 digits of their TiVo Service Number.
+MODELS = { "540" : "Series2",
+           "648" : "Series3",
+           "652" : "TiVo HD",
+           "658" : "TiVo HD XL",
+           "746" : "Premiere",
+           "748" : "Premiere XL",
+           "750" : "Premiere 4",
+           "758" : "Premiere Elite",
+           "840" : "Roamio",
+           "846" : "Roamio Plus",
+           "848" : "Roamio Pro",
+           "849" : "Bolt",
+           "A92" : "Mini",
+           "A93" : "Mini" }
+
+def feature_of(command):
+    """Returns the optional feature a command relies on, if any."""
+    data = command.split()
+
+    if not data:
+        return None
+
+    if data[0] == "TELEPORT" and len(data) > 1:
+        return f"TELEPORT {data[1]}"
+
+    if data[0] in ("KEYBOARD", "FORCECH"):
+        return data[0]
+
+    return None
+
+def decode_txt(properties):
+    """Converts zeroconf TXT properties (bytes to bytes) into strings."""
+    result = {}
+
+    for key, value in properties.items():
+        if isinstance(key, bytes):
+            key = key.decode('utf-8', 'replace')
+
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', 'replace')
+
+        result[key] = value
+
+    return result
+
+class Capabilities:
+    """Describes which parts of the protocol a particular TiVo supports."""
+    def __init__(self, model=None, platform=None, software=None,
+                 unsupported=()):
+        self.model = model
+        self.platform = platform
+        self.software = software
+
+        # Features (see FEATURES) that this TiVo is known not to support.
+        self.unsupported = set(unsupported)
+
+    @classmethod
+    def from_txt(cls, properties):
+        """Detects the capabilities of a TiVo from its mDNS TXT records."""
+        properties = decode_txt(properties)
+
+        platform = properties.get('platform')
+        software = properties.get('swversion')
+        tsn = properties.get('TSN', properties.get('tsn', ''))
+
+        model = MODELS.get(tsn.replace('tsn:', '')[:3].upper())
+
+        unsupported = ()
+
+        # Series1 and Series2 units only implement version 1.0 of the
+        # protocol, which lacks everything in FEATURES.
+        if (platform and ('Series1' in platform or 'Series2' in platform)) or \
+           model == "Series2":
+            unsupported = FEATURES
+
+        return cls(model, platform, software, unsupported)
+
+    def supports(self, command):
+        """Returns True if the TiVo understands `command` as is."""
+        feature = feature_of(command)
+
+        return feature is None or feature not in self.unsupported
+
+    def translate(self, command):
+        """
+        Returns the command that should actually be sent to the TiVo: the
+        command itself, an equivalent the TiVo supports, or None if there's no
+        way of sending it.
+        """
+        if self.supports(command):
+            return command
+
+        rewrite = REWRITES.get(command.strip())
+
+        if rewrite is not None and self.supports(rewrite):
+            return rewrite
+
+        return None
+
+    def to_dict(self):
+        return { "model"       : self.model,
+                 "platform"    : self.platform,
+                 "software"    : self.software,
+                 "unsupported" : sorted(self.unsupported) }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("model"),
+                   data.get("platform"),
+                   data.get("software"),
+                   data.get("unsupported", ()))
+
+class CapabilityCache:
+    """
+    Remembers the capabilities of every TiVo on disk, keyed by address, so
+    that they only ever have to be detected once.
+    """
+    def __init__(self, path=None):
+        self.path = path or cache_path('capabilities.json')
+        self.profiles = load_json(self.path, {})
+
+    def get(self, address):
+        """
+        Returns the capabilities of a TiVo. Unknown TiVos are assumed to
+        support everything.
+        """
+        data = self.profiles.get(address)
+
+        if data is None:
+            return Capabilities()
+
+        return Capabilities.from_dict(data)
+
+    def store(self, address, capabilities):
+        """Saves the capabilities of a TiVo, if they've changed."""
+        data = capabilities.to_dict()
+
+        if self.profiles.get(address) == data:
+            return
+
+        self.profiles[address] = data
+
+        try:
+            save_json(self.path, self.profiles)
+        except OSError as e:
+            print(f"Unable to save {self.path}: {e}")
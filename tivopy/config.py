@@ -0,0 +1,75 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""Locations of the files TiVoPy keeps between runs."""
+
+import json
+import os
+
+def app_path(base, filename):
+    """
+    Returns the full path of a TiVoPy file under `base`, creating the
+    directory if necessary.
+    """
+    directory = os.path.join(base, 'tivopy')
+    os.makedirs(directory, exist_ok=True)
+
+    return os.path.join(directory, filename)
+
+def cache_path(filename):
+    """
+    Returns the full path of a file in the TiVoPy cache directory. Anything
+    in here can be thrown away and rebuilt.
+    """
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME',
+                              os.path.join(os.path.expanduser('~'), '.cache'))
+
+    return app_path(base, filename)
+
+def config_path(filename):
+    """
+    Returns the full path of a file in the TiVoPy configuration directory,
+    for things the user has set up themselves.
+    """
+    if os.name == 'nt':
+        base = os.environ.get('APPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CONFIG_HOME',
+                              os.path.join(os.path.expanduser('~'),
+                                           '.config'))
+
+    return app_path(base, filename)
+
+def load_json(path, default):
+    """
+    Reads a JSON file, returning `default` if it doesn't exist or can't be
+    parsed. A broken cache file should never prevent the program starting.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def save_json(path, data):
+    """Atomically replaces a JSON file."""
+    temp_path = path + '.tmp'
+
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=4, sort_keys=True)
+
+    os.replace(temp_path, path)
@@ -0,0 +1,147 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+from time import time
+
+from .protocol import normalize_channel
+
+# Buttons that don't take the TiVo out of live TV mode when pressed. Anything
+# else might open a menu, so we can no longer assume live TV afterwards.
+PASSIVE_CODES = ("VOLUMEUP",
+                 "VOLUMEDOWN",
+                 "MUTE",
+                 "INFO",
+                 "CHANNELUP",
+                 "CHANNELDOWN",
+                 "PAUSE",
+                 "PLAY",
+                 "REVERSE",
+                 "FORWARD",
+                 "RECORD",
+                 "THUMBSUP",
+                 "THUMBSDOWN")
+
+class DeviceState:
+    """Everything we know about a TiVo without having to ask it."""
+    def __init__(self, address):
+        self.address = address
+
+        # The channel the TiVo is tuned into, as last reported by CH_STATUS.
+        self.channel = None
+        self.subchannel = None
+
+        # Why the channel last changed (LOCAL, REMOTE or RECORDING).
+        self.reason = None
+
+        # Whether or not the TiVo is in live TV mode. None means that we
+        # simply don't know.
+        self.live = None
+
+        # When we last heard anything from the TiVo (seconds since the epoch).
+        self.last_seen = None
+
+    def update(self, response):
+        """Called with every response received from the TiVo."""
+        self.last_seen = time()
+
+        if response.kind == "CH_STATUS":
+            self.channel = normalize_channel(response.channel)
+            self.subchannel = normalize_channel(response.subchannel)
+            self.reason = response.reason
+
+            # The TiVo only reports channel changes while it's showing live
+            # TV, with the exception of a recording starting in the
+            # background.
+            if response.reason != "RECORDING":
+                self.live = True
+        elif response.kind == "LIVETV_READY":
+            self.live = True
+        elif response.kind == "CH_FAILED" and response.reason == "NO_LIVE":
+            self.live = False
+
+    def observe_command(self, command):
+        """Called with every command that is actually sent to the TiVo."""
+        data = command.split()
+
+        if not data or data[0] in ("SETCH", "FORCECH"):
+            return
+
+        if data[0] == "IRCODE" and len(data) > 1 and \
+           data[1] in PASSIVE_CODES:
+            return
+
+        self.live = None
+
+    def is_redundant(self, command):
+        """
+        Returns True if sending `command` wouldn't change anything, i.e.
+        changing to the channel the TiVo is already tuned into.
+        """
+        data = command.split()
+
+        # FORCECH is deliberately excluded; the user wants a recording
+        # stopped.
+        if len(data) < 2 or data[0] != "SETCH":
+            return False
+
+        if not self.live or self.channel is None:
+            return False
+
+        subchannel = data[2] if len(data) > 2 else None
+
+        return normalize_channel(data[1]) == self.channel and \
+               normalize_channel(subchannel) == self.subchannel
+
+    def describe_channel(self):
+        """Returns the channel in a form suitable for display."""
+        if self.channel is None:
+            return "unknown"
+
+        if self.subchannel:
+            return f"{self.channel}-{self.subchannel}"
+
+        return self.channel
+
+class DeviceStates:
+    """Tracks the state of every TiVo we've spoken to, keyed by address."""
+    def __init__(self):
+        self.states = {}
+
+    def get(self, address):
+        """Returns the state of a TiVo, creating it if necessary."""
+        state = self.states.get(address)
+
+        if state is None:
+            state = DeviceState(address)
+            self.states[address] = state
+
+        return state
+
+    def channel_of(self, address):
+        """
+        Returns the channel a TiVo was last known to be tuned into, or None
+        if we've never heard from it.
+        """
+        state = self.states.get(address)
+
+        if state is None:
+            return None
+
+        return state.channel
+
+    def __contains__(self, address):
+        return address in self.states
+
+    def __iter__(self):
+        return iter(self.states.values())
@@ -0,0 +1,44 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+from PySide2.QtCore import QObject, Signal
+
+from .registry import ADDED, REMOVED
+
+class DiscoveryEvents(QObject):
+    """
+    Turns changes to a DeviceRegistry, made on the discovery thread, into
+    signals. Slots on the GUI thread receive them through the event queue.
+    """
+    added = Signal(object)
+    updated = Signal(object)
+    removed = Signal(object)
+
+    def __init__(self, registry):
+        super(DiscoveryEvents, self).__init__()
+
+        self.registry = registry
+        self.registry.listeners.append(self.registry_changed)
+
+    def registry_changed(self, event, tivo):
+        if event == ADDED:
+            self.added.emit(tivo)
+        elif event == REMOVED:
+            self.removed.emit(tivo)
+        else:
+            self.updated.emit(tivo)
+
+    def close(self):
+        """Stops turning changes into signals."""
+        self.registry.listeners.remove(self.registry_changed)
@@ -0,0 +1,433 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""
+One discovery service for every TiVoPy process on the machine.
+
+Rather than each process browsing for TiVos itself, the first to need them
+starts `python -m tivopy discovery-service` in the background. The service
+does the browsing, probing and scanning, and later processes subscribe to
+it over a loopback port recorded, along with a secret token, in a file only
+the user can read. Subscribers are sent everything known so far straight
+away, followed by every change as it happens. The service exits once
+nobody has been subscribed for a while.
+
+Messages in both directions are single JSON lines. Nothing in here may
+import PySide2.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+from time import monotonic, sleep
+
+from .config import cache_path, load_json
+from .instance import publish, withdraw
+from .proxy import MAX_CLIENT_BUFFER
+from .registry import REMOVED, DeviceRegistry, tivo_from_dict, tivo_to_dict
+from .tivo_discovery import (START_ERRORS,
+                             TiVoDiscovery,
+                             interface_addresses,
+                             scan_network_of)
+
+# Seconds the service keeps running without any subscribers, so that
+# starting TiVoPy again shortly after closing it lists everything at once.
+IDLE_TIMEOUT = 60
+
+# Seconds we wait for a service we've started to be ready.
+START_TIMEOUT = 5.0
+
+# Seconds between attempts to reconnect to a service that has gone away.
+RECONNECT_INTERVAL = 1.0
+
+def service_path():
+    return cache_path('discovery-service.json')
+
+def canonical_interfaces(interfaces):
+    """Puts a list of interfaces in the form services report them in."""
+    return sorted(interfaces) if interfaces else None
+
+def encode(message):
+    return json.dumps(message).encode('utf-8') + b"\n"
+
+class Subscriber:
+    """A process subscribed to the service."""
+    def __init__(self, writer):
+        self.writer = writer
+
+    def send(self, message):
+        """Sends a message, returning False if the subscriber is stuck."""
+        transport = self.writer.transport
+
+        if transport.is_closing() or \
+           transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+            return False
+
+        self.writer.write(encode(message))
+        return True
+
+class DiscoveryService:
+    """Shares a TiVoDiscovery with every process that subscribes to it."""
+    def __init__(self, interfaces=None, idle_timeout=IDLE_TIMEOUT):
+        self.interfaces = interfaces
+        self.idle_timeout = idle_timeout
+
+        self.subscribers = []
+        self.token = None
+
+        self.loop = None
+        self.discovery = None
+
+    async def run(self):
+        """Serves subscribers until there haven't been any for a while."""
+        running = connect_service()
+
+        if running is not None:
+            running.close()
+            print("The discovery service is already running.")
+            return 0
+
+        self.loop = asyncio.get_running_loop()
+
+        # Nothing is published until discovery has started, so that a
+        # service that can't start leaves nothing behind for clients to
+        # wait on.
+        try:
+            self.discovery = TiVoDiscovery(interfaces=self.interfaces)
+        except START_ERRORS as e:
+            print(f"Unable to look for TiVos: {e}")
+            return 1
+
+        self.discovery.registry.listeners.append(self.registry_changed)
+
+        server = await asyncio.start_server(self.handle_client,
+                                            '127.0.0.1',
+                                            0)
+
+        # Subscribers are only let in once there's something to send them.
+        self.token = publish(server.sockets[0].getsockname()[1],
+                             service_path())
+
+        try:
+            await self.wait_until_idle()
+        finally:
+            withdraw(service_path())
+            server.close()
+            await server.wait_closed()
+
+            # Saves what was discovered, for the next service to list.
+            self.discovery.close()
+
+        return 0
+
+    async def wait_until_idle(self):
+        last_active = monotonic()
+
+        while True:
+            await asyncio.sleep(1)
+
+            # Two services started at the same moment both publish
+            # themselves, and only the last to do so is found. The other
+            # steps aside, and its subscribers move over when they lose
+            # their connection.
+            if load_json(service_path(), {}).get("pid") != os.getpid():
+                print("Another discovery service has taken over, exiting.")
+                return
+
+            if self.subscribers:
+                last_active = monotonic()
+            elif monotonic() - last_active > self.idle_timeout:
+                print("No subscribers, exiting.")
+                return
+
+    def registry_changed(self, event, tivo):
+        """Called on the discovery thread after every change."""
+        message = { "event" : event, "tivo" : tivo_to_dict(tivo) }
+        self.loop.call_soon_threadsafe(self.broadcast, message)
+
+    def broadcast(self, message):
+        for subscriber in list(self.subscribers):
+            if not subscriber.send(message):
+                subscriber.writer.close()
+
+    async def handle_client(self, reader, writer):
+        subscriber = Subscriber(writer)
+
+        try:
+            request = json.loads(await asyncio.wait_for(reader.readline(),
+                                                        START_TIMEOUT))
+        except (OSError, ValueError, asyncio.TimeoutError):
+            request = None
+
+        if not isinstance(request, dict) or \
+           request.get("token") != self.token:
+            subscriber.send({ "error" : "FORBIDDEN" })
+            writer.close()
+            return
+
+        # Changes made from here on are sent as they happen, so nothing
+        # falls between the snapshot and the first of them.
+        snapshot = self.discovery.registry.snapshot
+        subscriber.send({ "interfaces" : canonical_interfaces(self.interfaces),
+                          "snapshot"   : [tivo_to_dict(tivo)
+                                          for tivo in snapshot] })
+        self.subscribers.append(subscriber)
+
+        try:
+            while True:
+                line = await reader.readline()
+
+                if not line:
+                    break
+
+                try:
+                    request = json.loads(line)
+                    self.discovery.scan(request["scan"])
+                except (ValueError, KeyError, TypeError) as e:
+                    subscriber.send({ "error" : str(e) })
+        except OSError:
+            pass
+        finally:
+            self.subscribers.remove(subscriber)
+            writer.close()
+
+def connect_service(timeout=2.0):
+    """
+    Connects to the running discovery service and subscribes to it.
+    Returns the socket, or None if the service isn't running.
+    """
+    service = load_json(service_path(), {})
+
+    if "port" not in service:
+        return None
+
+    try:
+        s = socket.create_connection(('127.0.0.1', service["port"]),
+                                     timeout)
+    except OSError:
+        # Left behind by a service that didn't exit cleanly.
+        return None
+
+    try:
+        s.sendall(encode({ "token" : service.get("token") }))
+    except OSError:
+        s.close()
+        return None
+
+    return s
+
+def start_service(interfaces=None):
+    """
+    Starts the discovery service in the background, on `interfaces` if
+    given, and waits for it to be ready. Returns a subscribed socket, or
+    None if it couldn't be started.
+    """
+    command = [sys.executable, '-m', 'tivopy', 'discovery-service']
+
+    for interface in interfaces or ():
+        command.append(f"--interface={interface}")
+
+    # The service outlives us, so it mustn't share our console or be
+    # killed along with us.
+    if os.name == 'nt':
+        options = { "creationflags" : subprocess.DETACHED_PROCESS |
+                                      subprocess.CREATE_NEW_PROCESS_GROUP }
+    else:
+        options = { "start_new_session" : True }
+
+    try:
+        process = subprocess.Popen(command,
+                                   cwd=os.path.dirname(
+                                       os.path.dirname(__file__)),
+                                   stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL,
+                                   **options)
+    except OSError as e:
+        print(f"Unable to start the discovery service: {e}")
+        return None
+
+    deadline = monotonic() + START_TIMEOUT
+
+    while monotonic() < deadline:
+        s = connect_service()
+
+        if s is not None:
+            return s
+
+        # Ours has exited: either discovery couldn't start, or another
+        # process started a service at the same time and ours gave way to
+        # it. In the latter case the other one may still be getting ready.
+        if process.poll() is not None and \
+           (process.returncode != 0 or
+            load_json(service_path(), {}).get("port") is None):
+            break
+
+        sleep(0.05)
+
+    print("The discovery service didn't start.")
+    return None
+
+class DiscoveryClient:
+    """
+    Subscribes to the discovery service, keeping a DeviceRegistry of its own
+    up to date with what the service finds. Stands in for TiVoDiscovery.
+
+    Raises OSError if the service can't be started, or is already running
+    and looking for TiVos on interfaces other than `interfaces`.
+    """
+    def __init__(self, interfaces=None):
+        self.registry = DeviceRegistry()
+        self.interfaces = interfaces
+
+        self.socket = None
+        self.closed = threading.Event()
+
+        # The snapshot is read before returning, so that everything the
+        # service knows is listed at once.
+        self.lines = self.subscribe()
+
+        if self.lines is None:
+            raise OSError("the discovery service isn't available to us")
+
+        self.thread = threading.Thread(target=self.run,
+                                       name="DiscoveryClient",
+                                       daemon=True)
+        self.thread.start()
+
+    def subscribe(self):
+        """
+        Subscribes to the service, starting it if it isn't running, and
+        applies its snapshot. Returns the lines that follow, or None.
+        """
+        s = connect_service() or start_service(self.interfaces)
+
+        if s is None:
+            return None
+
+        lines = s.makefile('rb')
+
+        try:
+            s.settimeout(START_TIMEOUT)
+            reply = json.loads(lines.readline())
+            tivos = [tivo_from_dict(data) for data in reply["snapshot"]]
+            s.settimeout(None)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Unable to subscribe to the discovery service: {e}")
+            s.close()
+            return None
+
+        # The service looks for TiVos wherever its first subscriber asked
+        # it to, which may not be where we want them looked for.
+        if reply.get("interfaces") != canonical_interfaces(self.interfaces):
+            print("The discovery service is looking for TiVos on other "
+                  "interfaces.")
+            s.close()
+            return None
+
+        self.socket = s
+
+        # After reconnecting, anything the service no longer knows about
+        # has gone.
+        keys = {tivo.key for tivo in tivos}
+
+        for tivo in self.registry.snapshot:
+            if tivo.key not in keys:
+                self.registry.remove(tivo.key)
+
+        for tivo in tivos:
+            self.registry.put(tivo)
+
+        return lines
+
+    def run(self):
+        while not self.closed.is_set():
+            try:
+                for line in self.lines:
+                    self.handle_message(json.loads(line))
+            except (OSError, ValueError):
+                pass
+
+            self.socket.close()
+
+            # The service crashed, or was killed; start another.
+            while not self.closed.is_set():
+                self.lines = self.subscribe()
+
+                if self.lines is not None:
+                    break
+
+                self.closed.wait(RECONNECT_INTERVAL)
+
+    def handle_message(self, message):
+        if "error" in message:
+            print(f"Discovery service: {message['error']}")
+            return
+
+        try:
+            tivo = tivo_from_dict(message["tivo"])
+        except (KeyError, TypeError):
+            return
+
+        if message.get("event") == REMOVED:
+            self.registry.remove(tivo.key)
+        else:
+            self.registry.put(tivo)
+
+    def scan(self, network):
+        """
+        Has the service scan `network` for TiVos. Returns the network as
+        given by scan_network_of(), which raises ValueError if it can't be
+        scanned.
+        """
+        network = scan_network_of(network)
+
+        try:
+            self.socket.sendall(encode({ "scan" : network }))
+        except OSError as e:
+            print(f"Unable to reach the discovery service: {e}")
+
+        return network
+
+    def close(self):
+        """Unsubscribes, leaving the service to the other subscribers."""
+        self.closed.set()
+
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        self.thread.join()
+
+def open_discovery(interfaces=None):
+    """
+    Returns a DiscoveryClient subscribed to the discovery service, or if it
+    can't be started, a TiVoDiscovery of our own. Raises ValueError if any
+    of `interfaces` aren't network interfaces of this machine.
+    """
+    # A mistyped interface would stop the service starting, only to fail
+    # again in our own TiVoDiscovery.
+    if interfaces is not None:
+        interface_addresses(interfaces)
+
+    try:
+        return DiscoveryClient(interfaces)
+    except OSError as e:
+        print(f"Discovering TiVos ourselves, {e}.")
+        return TiVoDiscovery(interfaces=interfaces)
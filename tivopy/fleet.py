@@ -0,0 +1,236 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""Operations performed on many TiVos at once, without the GUI."""
+
+import asyncio
+import json
+from time import perf_counter, time
+
+from .aio_client import AsyncTiVoClient, TiVoError
+from .config import save_json
+from .inventory import Device
+
+def percentiles(values):
+    """Returns the 50th, 90th and 99th percentile and maximum of `values`."""
+    values = sorted(values)
+
+    if not values:
+        return (0.0, 0.0, 0.0, 0.0)
+
+    def percentile(p):
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+    return (percentile(0.5),
+            percentile(0.9),
+            percentile(0.99),
+            values[-1])
+
+class Result:
+    """The outcome of an operation on a single TiVo."""
+    def __init__(self, device, ok, detail, elapsed):
+        self.device = device
+        self.ok = ok
+
+        # The channel on success, the error code on failure.
+        self.detail = detail
+
+        # How long the operation took, in seconds.
+        self.elapsed = elapsed
+
+class Summary:
+    """The outcome of an operation on a number of TiVos."""
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    def latencies(self):
+        """
+        Returns the 50th, 90th and 99th percentile and maximum time taken by
+        a single TiVo, in milliseconds.
+        """
+        return percentiles(result.elapsed * 1000 for result in self.results)
+
+    def __str__(self):
+        lines = [f"{len(self.succeeded)} of {len(self.results)} TiVo(s) "
+                 f"succeeded in {self.elapsed:.2f} s"]
+
+        for result in self.failed:
+            lines.append(f"  {result.device.name} "
+                         f"({result.device.key}): {result.detail}")
+
+        return "\n".join(lines)
+
+async def run_bounded(operation, devices, concurrency, on_result=None):
+    """
+    Runs `operation(device)` for every device with no more than
+    `concurrency` running at once, returning a Summary.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(device):
+        async with semaphore:
+            start = perf_counter()
+
+            try:
+                detail = await operation(device)
+                ok = True
+            except TiVoError as e:
+                detail, ok = e.code, False
+            except (OSError, asyncio.TimeoutError) as e:
+                detail, ok = str(e) or type(e).__name__, False
+
+            result = Result(device, ok, detail, perf_counter() - start)
+
+            if on_result:
+                on_result(result)
+
+            return result
+
+    start = perf_counter()
+    results = await asyncio.gather(*(run(device) for device in devices))
+
+    return Summary(results, perf_counter() - start)
+
+async def execute(client, commands, timeout):
+    """
+    Sends a command, or every command of a macro, to a connected TiVo.
+    Channel changes are waited on until the TiVo confirms them. Returns a
+    short description of the outcome.
+    """
+    detail = "sent"
+
+    for command in commands:
+        data = command.split()
+
+        if len(data) > 1 and data[0] in ("SETCH", "FORCECH"):
+            subchannel = data[2] if len(data) > 2 else None
+
+            state = await client.set_channel(data[1],
+                                             subchannel,
+                                             force=data[0] == "FORCECH",
+                                             timeout=timeout)
+            detail = state.describe_channel()
+        else:
+            await client.send_command(command)
+            detail = "sent"
+
+    return detail
+
+async def read_channel(device, timeout):
+    """Connects to a TiVo just long enough to learn its channel."""
+    client = AsyncTiVoClient(device.address, device.port)
+
+    try:
+        await client.connect(timeout)
+        state = await client.status(timeout)
+    finally:
+        await client.close()
+
+    return state
+
+async def snapshot(devices, path, concurrency=16, timeout=5.0,
+                   on_result=None):
+    """
+    Saves the channel every TiVo is tuned into to `path`. TiVos that can't
+    be reached are saved without one, so that restoring reports them.
+    """
+    channels = []
+
+    async def operation(device):
+        state = await read_channel(device, timeout)
+
+        channels.append(dict(device.to_dict(),
+                             channel=state.channel,
+                             subchannel=state.subchannel))
+
+        return state.describe_channel()
+
+    summary = await run_bounded(operation, devices, concurrency, on_result)
+
+    for result in summary.failed:
+        channels.append(dict(result.device.to_dict(),
+                             channel=None,
+                             subchannel=None))
+
+    save_json(path, { "created" : time(), "devices" : channels })
+
+    return summary
+
+def load_snapshot(path):
+    """
+    Returns the contents of a snapshot as a list of (device, channel,
+    subchannel). The channel is None for TiVos that couldn't be reached.
+    Raises ValueError if the snapshot can't be read.
+    """
+    entries = []
+
+    # Unlike a cache, a snapshot that can't be read must never be taken for
+    # an empty one.
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+
+        for data in snapshot["devices"]:
+            entries.append((Device.from_dict(data),
+                            data["channel"],
+                            data.get("subchannel")))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Unable to read the snapshot {path}: {e}")
+
+    return entries
+
+async def restore(path, concurrency=16, timeout=5.0, on_result=None):
+    """
+    Tunes every TiVo in a snapshot back into the channel it was on, waiting
+    for each one to confirm the change. Raises ValueError if the snapshot
+    can't be read.
+    """
+    entries = load_snapshot(path)
+    channels = { device.key : (channel, subchannel)
+                 for device, channel, subchannel in entries }
+
+    async def operation(device):
+        channel, subchannel = channels[device.key]
+
+        if channel is None:
+            raise TiVoError("NO_SAVED_CHANNEL", device.address)
+
+        client = AsyncTiVoClient(device.address, device.port)
+
+        try:
+            await client.connect(timeout)
+
+            # Knowing the current channel means a TiVo that is already on
+            # the right one isn't sent anything at all.
+            await client.status(timeout)
+            state = await client.set_channel(channel, subchannel,
+                                             timeout=timeout)
+        finally:
+            await client.close()
+
+        return state.describe_channel()
+
+    return await run_bounded(operation,
+                             [device for device, _, _ in entries],
+                             concurrency,
+                             on_result)
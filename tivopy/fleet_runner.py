@@ -0,0 +1,285 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""
+Drives very large fleets of TiVos by spreading them over several worker
+processes, each with its own event loop and connections.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import queue
+from time import perf_counter
+from zlib import crc32
+
+from .fleet import Result, Summary, execute, run_bounded
+from .pool import ConnectionPool, Timeouts
+
+# Seconds between checks that the workers we're waiting on are still alive.
+WORKER_CHECK_INTERVAL = 1.0
+
+def raise_fd_limit():
+    """
+    Allows a process as many open files as the system will let it have, as
+    every TiVo connection costs one.
+    """
+    try:
+        import resource
+    except ImportError:
+        # Windows has no such limit to speak of.
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+def max_rss():
+    """Returns the peak memory use of this process in kilobytes, if known."""
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class WorkerMetrics:
+    """What a worker process reports after each batch."""
+    def __init__(self, worker, devices, connections, open_breakers, busy,
+                 rss):
+        self.worker = worker
+
+        # How many TiVos the worker has handled so far.
+        self.devices = devices
+
+        # How many connections the worker is holding open.
+        self.connections = connections
+
+        # How many of the worker's TiVos are currently being failed fast.
+        self.open_breakers = open_breakers
+
+        # Seconds spent working on batches so far.
+        self.busy = busy
+
+        # Peak memory use in kilobytes.
+        self.rss = rss
+
+async def serve(worker, jobs, results, concurrency, pool_options):
+    """Runs batches of work for one worker until told to stop."""
+    pool = ConnectionPool(**pool_options)
+    loop = asyncio.get_event_loop()
+
+    handled = 0
+    busy = 0.0
+
+    async def operation(device, commands):
+        async with pool.lease(device) as client:
+            return await execute(client, commands, pool.timeouts.ack)
+
+    while True:
+        # Waiting on a multiprocessing queue blocks, keep it off the loop.
+        job = await loop.run_in_executor(None, jobs.get)
+
+        if job is None:
+            break
+
+        batch, devices, commands = job
+        start = perf_counter()
+
+        summary = await run_bounded(
+            lambda device: operation(device, commands),
+            devices,
+            concurrency)
+
+        handled += len(devices)
+        busy += perf_counter() - start
+
+        results.put((batch,
+                     summary.results,
+                     WorkerMetrics(worker,
+                                   handled,
+                                   len(pool),
+                                   pool.open_breakers(),
+                                   busy,
+                                   max_rss())))
+
+    await pool.close()
+
+def worker_main(worker, jobs, results, concurrency, pool_options):
+    """Entry point of a worker process."""
+    raise_fd_limit()
+
+    asyncio.run(serve(worker, jobs, results, concurrency, pool_options))
+
+class FleetRunner:
+    """
+    Coordinates a pool of worker processes.
+
+    Every TiVo is always handled by the same worker, chosen by hashing its
+    key, so its connection is reused from one run to the next.
+    """
+    def __init__(self, workers=None, concurrency=256, timeouts=None,
+                 failure_threshold=3, reset_timeout=30.0, batch_size=256):
+        self.workers = workers or os.cpu_count() or 1
+
+        # Most TiVos each worker talks to at once.
+        self.concurrency = concurrency
+
+        # How each worker sets up its ConnectionPool.
+        self.pool_options = { "timeouts"          : timeouts or Timeouts(),
+                              "failure_threshold" : failure_threshold,
+                              "reset_timeout"     : reset_timeout }
+
+        # TiVos sent to a worker per message; large enough that the cost of
+        # passing messages between processes doesn't matter.
+        self.batch_size = batch_size
+
+        self.processes = []
+        self.jobs = []
+        self.results = None
+
+        # The latest WorkerMetrics from each worker.
+        self.metrics = {}
+
+        self.next_batch = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        # Forking a process that may already be running threads or an event
+        # loop is asking for trouble.
+        context = multiprocessing.get_context("spawn")
+
+        self.results = context.Queue()
+
+        for worker in range(self.workers):
+            jobs = context.Queue()
+            process = context.Process(target=worker_main,
+                                      args=(worker,
+                                            jobs,
+                                            self.results,
+                                            self.concurrency,
+                                            self.pool_options),
+                                      daemon=True)
+            process.start()
+
+            self.jobs.append(jobs)
+            self.processes.append(process)
+
+    def stop(self):
+        for jobs in self.jobs:
+            jobs.put(None)
+
+        for process in self.processes:
+            process.join()
+
+        self.processes = []
+        self.jobs = []
+
+    def shard(self, device):
+        """Returns the worker responsible for a TiVo."""
+        return crc32(device.key.encode('utf-8')) % self.workers
+
+    def run(self, devices, commands, on_result=None):
+        """
+        Sends a command or macro to every TiVo, returning a Summary once
+        every worker has finished.
+        """
+        shards = [[] for _ in range(self.workers)]
+
+        for device in devices:
+            shards[self.shard(device)].append(device)
+
+        start = perf_counter()
+
+        # Batches not yet finished, to (worker, devices).
+        pending = {}
+
+        for worker, shard in enumerate(shards):
+            for i in range(0, len(shard), self.batch_size):
+                batch = self.next_batch
+                self.next_batch += 1
+
+                self.jobs[worker].put((batch,
+                                       shard[i:i + self.batch_size],
+                                       commands))
+                pending[batch] = (worker, shard[i:i + self.batch_size])
+
+        results = []
+
+        while pending:
+            try:
+                batch, batch_results, metrics = \
+                    self.results.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                # A worker that has died, say killed for running out of
+                # memory, will never finish its batches.
+                batch_results = self.abandon_dead_workers(pending)
+            else:
+                pending.pop(batch, None)
+                self.metrics[metrics.worker] = metrics
+
+            if on_result:
+                for result in batch_results:
+                    on_result(result)
+
+            results.extend(batch_results)
+
+        return Summary(results, perf_counter() - start)
+
+    def abandon_dead_workers(self, pending):
+        """
+        Removes the batches of workers that have exited from `pending`,
+        returning a failed Result for each of their TiVos.
+        """
+        results = []
+
+        for batch, (worker, devices) in list(pending.items()):
+            process = self.processes[worker]
+
+            if process.is_alive():
+                continue
+
+            del pending[batch]
+
+            for device in devices:
+                results.append(Result(device,
+                                      False,
+                                      f"WORKER_EXITED ({process.exitcode})",
+                                      0.0))
+
+        return results
+
+    def describe_metrics(self):
+        """Returns the metrics of every worker, suitable for display."""
+        lines = []
+
+        for worker, metrics in sorted(self.metrics.items()):
+            rss = f"{metrics.rss // 1024} MiB" if metrics.rss else "unknown"
+
+            lines.append(f"worker {worker}: {metrics.devices} TiVo(s), "
+                         f"{metrics.connections} connection(s), "
+                         f"{metrics.open_breakers} open breaker(s), "
+                         f"busy {metrics.busy:.2f} s, peak memory {rss}")
+
+        return "\n".join(lines)
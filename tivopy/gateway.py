@@ -0,0 +1,577 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""
+A local HTTP and WebSocket gateway, so that other programs can drive TiVos.
+
+Every TiVo gets a single pooled connection, shared by all gateway clients.
+
+    POST /send   {"device": "...", "command": "IRCODE PAUSE"}
+    POST /setch  {"device": "...", "channel": 702, "subchannel": null,
+                  "force": false}
+    POST /macro  {"device": "...", "macro": ["IRCODE LIVETV", "SETCH 702"]}
+    GET  /state?device=...
+    GET  /breakers
+    GET  /events[?device=...]   (WebSocket, streams CH_STATUS as JSON)
+
+`device` is an inventory name or key ("address" or "address:port"). Unless
+the gateway is told to drive any TiVo, only those in the inventory can be
+driven, so that it can't be used to reach other hosts.
+"""
+
+import asyncio
+import json
+from base64 import b64encode
+from hashlib import sha1
+from urllib.parse import parse_qs, urlsplit
+
+from .aio_client import TiVoError
+from .breaker import OPEN
+from .fleet import execute
+from .groups import parse_macro
+from .inventory import find_device
+from .ratelimit import TokenBucket
+
+# Appended to the client's key during the WebSocket handshake (RFC 6455).
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Anything bigger than this isn't a remote control command.
+MAX_BODY = 64 * 1024
+
+STATUS_TEXT = { 200 : "OK",
+                400 : "Bad Request",
+                403 : "Forbidden",
+                404 : "Not Found",
+                405 : "Method Not Allowed",
+                409 : "Conflict",
+                413 : "Payload Too Large",
+                429 : "Too Many Requests",
+                431 : "Request Header Fields Too Large",
+                502 : "Bad Gateway",
+                503 : "Service Unavailable",
+                504 : "Gateway Timeout" }
+
+class HTTPError(Exception):
+    """Raised to answer a request with an error status."""
+    def __init__(self, status, error):
+        super(HTTPError, self).__init__(error)
+
+        self.status = status
+        self.error = error
+
+def error_status(error):
+    """Returns the HTTP status that best describes a TiVoError."""
+    if error.code == "CIRCUIT_OPEN":
+        return 503
+
+    if error.code == "TIMEOUT":
+        return 504
+
+    if error.code == "UNSUPPORTED_COMMAND":
+        return 400
+
+    if error.code in ("NOT_CONNECTED", "CONNECTION_CLOSED"):
+        return 502
+
+    # The TiVo itself refused, i.e. NO_LIVE.
+    return 409
+
+class Request:
+    """An HTTP request."""
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        self.version = version
+
+        # Header names are lower case.
+        self.headers = headers
+        self.body = body
+
+        url = urlsplit(target)
+        self.path = url.path
+        self.query = { key : values[-1]
+                       for key, values in parse_qs(url.query).items() }
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+
+        return connection != "close"
+
+    @property
+    def is_websocket(self):
+        return self.headers.get("upgrade", "").lower() == "websocket"
+
+    def json(self):
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "INVALID_JSON")
+
+        if not isinstance(data, dict):
+            raise HTTPError(400, "INVALID_JSON")
+
+        return data
+
+async def read_line(reader):
+    try:
+        return await reader.readline()
+    except ValueError:
+        # Longer than the reader's limit, which is far more than any
+        # request of ours needs.
+        raise HTTPError(431, "LINE_TOO_LONG")
+
+async def read_request(reader):
+    """Reads an HTTP request, returning None if the client went away."""
+    line = await read_line(reader)
+
+    if not line:
+        return None
+
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(400, "MALFORMED_REQUEST")
+
+    headers = {}
+
+    while True:
+        line = await read_line(reader)
+
+        if line in (b"\r\n", b"\n", b""):
+            break
+
+        if len(headers) >= 100:
+            raise HTTPError(400, "TOO_MANY_HEADERS")
+
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(400, "MALFORMED_REQUEST")
+
+    if length < 0:
+        raise HTTPError(400, "MALFORMED_REQUEST")
+
+    if length > MAX_BODY:
+        raise HTTPError(413, "BODY_TOO_LARGE")
+
+    body = await reader.readexactly(length) if length else b""
+
+    return Request(method, target, version, headers, body)
+
+def write_response(writer, status, data, keep_alive=True):
+    body = json.dumps(data).encode('utf-8')
+
+    writer.write(f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                 "Content-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n"
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                 "\r\n".encode('latin-1') + body)
+
+def websocket_frame(payload, opcode=0x1):
+    """Encodes a single, final, unmasked WebSocket frame."""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + length.to_bytes(2, 'big')
+    else:
+        header += bytes([127]) + length.to_bytes(8, 'big')
+
+    return header + payload
+
+async def read_websocket_frame(reader):
+    """Reads a WebSocket frame from a client, returning (opcode, payload)."""
+    first, second = await reader.readexactly(2)
+
+    opcode = first & 0x0F
+    length = second & 0x7F
+
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), 'big')
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), 'big')
+
+    if length > MAX_BODY:
+        raise HTTPError(413, "FRAME_TOO_LARGE")
+
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+
+    if mask:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+    return opcode, payload
+
+def state_event(device, state):
+    return json.dumps({ "device"     : device.key,
+                        "channel"    : state.channel,
+                        "subchannel" : state.subchannel,
+                        "reason"     : state.reason,
+                        "live"       : state.live,
+                        "last_seen"  : state.last_seen })
+
+class Subscriber:
+    """A WebSocket client receiving CH_STATUS events."""
+    def __init__(self, device, size):
+        # Only events for this Device.key are wanted, or all if None. The
+        # latter only sees TiVos somebody else has caused a connection to.
+        self.device = device
+
+        # Events are dropped, and the subscriber disconnected, rather than
+        # queued without limit for a client that can't keep up.
+        self.queue = asyncio.Queue(size)
+        self.overflowed = False
+
+class Gateway:
+    """Serves the HTTP and WebSocket API on top of a ConnectionPool."""
+    # How often connections of TiVos with WebSocket subscribers are checked,
+    # and reopened if necessary, in seconds.
+    KEEP_WARM_INTERVAL = 5.0
+
+    def __init__(self, pool, devices=None, max_in_flight=256,
+                 client_rate=20.0, client_burst=40, queue_size=256,
+                 any_device=False):
+        self.pool = pool
+        self.pool.listeners.append(self.on_response)
+
+        # An Inventory, or a dict of names and keys to Device.
+        self.devices = devices or {}
+
+        # Whether TiVos that aren't in `devices` may be driven by address.
+        self.any_device = any_device
+
+        # Requests to TiVos beyond this many at once are shed with a 503
+        # instead of queueing.
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+        # Per client address token buckets.
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.buckets = {}
+
+        self.queue_size = queue_size
+        self.subscribers = set()
+
+        # TiVos whose events somebody is waiting for, keyed by Device.key as
+        # [device, number of subscribers].
+        self.watched = {}
+
+        self.server = None
+        self.keeper = None
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self.handle_connection,
+                                                 host,
+                                                 port)
+        self.keeper = asyncio.ensure_future(self.keep_warm())
+
+        return self.server
+
+    async def close(self):
+        if self.keeper:
+            self.keeper.cancel()
+
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def bucket(self, host):
+        bucket = self.buckets.get(host)
+
+        if bucket is None:
+            # Forget clients that have been quiet long enough to have a full
+            # bucket, so that this doesn't grow forever.
+            if len(self.buckets) >= 10000:
+                for key, old in list(self.buckets.items()):
+                    old.refill()
+
+                    if old.tokens >= old.burst:
+                        del self.buckets[key]
+
+            bucket = self.buckets[host] = TokenBucket(self.client_rate,
+                                                      self.client_burst)
+
+        return bucket
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        host = peer[0] if peer else None
+
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as e:
+                    write_response(writer, e.status, { "error" : e.error },
+                                   False)
+                    break
+
+                if request is None:
+                    break
+
+                try:
+                    if request.is_websocket:
+                        await self.stream_events(host, request, reader, writer)
+                        break
+
+                    status, data = await self.dispatch(host, request)
+                except HTTPError as e:
+                    status, data = e.status, { "error" : e.error }
+
+                write_response(writer, status, data, request.keep_alive)
+                await writer.drain()
+
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def find_device(self, data):
+        device = data.get("device")
+
+        if not device:
+            raise HTTPError(400, "MISSING_DEVICE")
+
+        try:
+            device = find_device(str(device), self.devices)
+        except ValueError:
+            raise HTTPError(400, "INVALID_DEVICE")
+
+        if not self.any_device and self.devices.get(device.key) is None:
+            raise HTTPError(403, "UNKNOWN_DEVICE")
+
+        return device
+
+    async def dispatch(self, host, request):
+        """Handles a plain HTTP request, returning (status, data)."""
+        if not self.bucket(host).try_acquire():
+            raise HTTPError(429, "RATE_LIMITED")
+
+        if request.method == "GET":
+            if request.path == "/state":
+                device = self.find_device(request.query)
+                state = self.pool.states.get(device.key)
+
+                return 200, json.loads(state_event(device, state))
+
+            if request.path == "/breakers":
+                return 200, self.pool.breaker_states()
+
+            raise HTTPError(404, "NOT_FOUND")
+
+        if request.method != "POST":
+            raise HTTPError(405, "METHOD_NOT_ALLOWED")
+
+        data = request.json()
+        device = self.find_device(data)
+
+        if request.path == "/send":
+            commands = [str(data.get("command", ""))]
+        elif request.path == "/setch":
+            if "channel" not in data:
+                raise HTTPError(400, "MISSING_CHANNEL")
+
+            command = "FORCECH" if data.get("force") else "SETCH"
+            command = f"{command} {data['channel']}"
+
+            if data.get("subchannel"):
+                command += f" {data['subchannel']}"
+
+            commands = [command]
+        elif request.path == "/macro":
+            macro = data.get("macro", "")
+
+            if isinstance(macro, list):
+                commands = [str(command) for command in macro]
+            else:
+                commands = parse_macro(str(macro))
+        else:
+            raise HTTPError(404, "NOT_FOUND")
+
+        if not any(command.strip() for command in commands):
+            raise HTTPError(400, "MISSING_COMMAND")
+
+        # The protocol is ASCII only, anything else can't even be sent.
+        if not all(command.isascii() for command in commands):
+            raise HTTPError(400, "INVALID_COMMAND")
+
+        return 200, { "device" : device.key,
+                      "result" : await self.operate(device, commands) }
+
+    async def operate(self, device, commands):
+        """Runs commands on a TiVo, shedding load if we're too busy."""
+        if self.in_flight >= self.max_in_flight:
+            raise HTTPError(503, "OVERLOADED")
+
+        self.in_flight += 1
+
+        try:
+            async with self.pool.lease(device) as client:
+                return await execute(client, commands, self.pool.timeouts.ack)
+        except TiVoError as e:
+            raise HTTPError(error_status(e), e.code)
+        except (OSError, asyncio.TimeoutError):
+            raise HTTPError(502, "CONNECTION_FAILED")
+        finally:
+            self.in_flight -= 1
+
+    def on_response(self, device, response):
+        """Called with every response received from any TiVo."""
+        if response.kind != "CH_STATUS" or not self.subscribers:
+            return
+
+        event = state_event(device, self.pool.states.get(device.key))
+
+        for subscriber in list(self.subscribers):
+            if subscriber.device not in (None, device.key):
+                continue
+
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscriber.overflowed = True
+
+    def watch(self, device):
+        entry = self.watched.get(device.key)
+
+        if entry is None:
+            entry = self.watched[device.key] = [device, 0]
+            asyncio.ensure_future(self.warm(device))
+
+        entry[1] += 1
+
+    def unwatch(self, device):
+        entry = self.watched[device.key]
+        entry[1] -= 1
+
+        if entry[1] == 0:
+            del self.watched[device.key]
+
+    async def warm(self, device):
+        """Makes sure there's a connection open to a TiVo."""
+        if self.pool.breaker(device).state == OPEN:
+            return
+
+        try:
+            async with self.pool.lease(device):
+                pass
+        except (TiVoError, OSError, asyncio.TimeoutError):
+            pass
+
+    async def keep_warm(self):
+        """Reopens lost connections of TiVos with subscribers."""
+        while True:
+            await asyncio.sleep(self.KEEP_WARM_INTERVAL)
+
+            for device, count in list(self.watched.values()):
+                client = self.pool.clients.get(device.key)
+
+                if client is None or not client.connected:
+                    asyncio.ensure_future(self.warm(device))
+
+    async def stream_events(self, host, request, reader, writer):
+        """Handles a WebSocket client subscribing to CH_STATUS events."""
+        key = request.headers.get("sec-websocket-key")
+
+        if request.path != "/events" or not key:
+            write_response(writer, 400, { "error" : "BAD_WEBSOCKET" }, False)
+            return
+
+        if not self.bucket(host).try_acquire():
+            write_response(writer, 429, { "error" : "RATE_LIMITED" }, False)
+            return
+
+        device = None
+
+        if "device" in request.query:
+            device = self.find_device(request.query)
+
+        accept = b64encode(sha1((key + WEBSOCKET_GUID).encode('latin-1'))
+                           .digest()).decode('latin-1')
+
+        writer.write("HTTP/1.1 101 Switching Protocols\r\n"
+                     "Upgrade: websocket\r\n"
+                     "Connection: Upgrade\r\n"
+                     f"Sec-WebSocket-Accept: {accept}\r\n"
+                     "\r\n".encode('latin-1'))
+
+        subscriber = Subscriber(device.key if device else None,
+                                self.queue_size)
+        self.subscribers.add(subscriber)
+
+        if device:
+            self.watch(device)
+
+            # New subscribers start off with what we already know.
+            state = self.pool.states.get(device.key)
+
+            if state.channel is not None:
+                subscriber.queue.put_nowait(state_event(device, state))
+
+        frames = asyncio.ensure_future(self.read_frames(reader, writer))
+
+        try:
+            while not frames.done():
+                get = asyncio.ensure_future(subscriber.queue.get())
+                done, _ = await asyncio.wait((get, frames),
+                                             return_when=asyncio.FIRST_COMPLETED)
+
+                if get not in done:
+                    get.cancel()
+                    break
+
+                event = get.result()
+
+                if subscriber.overflowed:
+                    # Close with "message too big"; the client is too slow.
+                    writer.write(websocket_frame(b"\x03\xf1", 0x8))
+                    break
+
+                writer.write(websocket_frame(event))
+                await writer.drain()
+        finally:
+            frames.cancel()
+            self.subscribers.discard(subscriber)
+
+            if device:
+                self.unwatch(device)
+
+    async def read_frames(self, reader, writer):
+        """Answers pings and returns once the client closes."""
+        try:
+            while True:
+                opcode, payload = await read_websocket_frame(reader)
+
+                if opcode == 0x8:
+                    writer.write(websocket_frame(payload[:2], 0x8))
+                    return
+
+                if opcode == 0x9:
+                    writer.write(websocket_frame(payload, 0xA))
+        except (ConnectionError, asyncio.IncompleteReadError, HTTPError):
+            return
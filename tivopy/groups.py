@@ -0,0 +1,51 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+from .config import config_path, load_json, save_json
+
+def parse_macro(text):
+    """
+    Splits a macro into its commands. Commands in a macro are separated by
+    semicolons, i.e. "IRCODE LIVETV; SETCH 702".
+    """
+    return [command.strip() for command in text.split(';') if command.strip()]
+
+class DeviceGroups:
+    """Named groups of TiVos that can be controlled at once."""
+    def __init__(self, path=None):
+        self.path = path or config_path('groups.json')
+
+        # Group name to a list of IP addresses.
+        self.groups = load_json(self.path, {})
+
+    def names(self):
+        return sorted(self.groups)
+
+    def get(self, name):
+        return list(self.groups.get(name, []))
+
+    def set(self, name, addresses):
+        """Creates or replaces a group."""
+        self.groups[name] = list(addresses)
+        self.save()
+
+    def remove(self, name):
+        if self.groups.pop(name, None) is not None:
+            self.save()
+
+    def save(self):
+        try:
+            save_json(self.path, self.groups)
+        except OSError as e:
+            print(f"Unable to save {self.path}: {e}")
@@ -0,0 +1,95 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""
+Lets a second invocation of TiVoPy hand its work to the one already running,
+which has PySide2 loaded and a connection to the TiVo open.
+
+The running instance listens on a loopback port, recorded along with a
+secret token in a file only the user can read. Requests and replies are
+single JSON lines.
+
+Nothing in here may import PySide2.
+"""
+
+import json
+import os
+import secrets
+import socket
+
+from .config import cache_path, load_json
+
+def instance_path():
+    return cache_path('instance.json')
+
+def publish(port, path=None):
+    """
+    Records that this process is the running instance, listening on `port`,
+    in `path` if it's the running instance of something else. Returns the
+    token requests must carry.
+    """
+    token = secrets.token_hex(16)
+    path = path or instance_path()
+    temp_path = path + '.tmp'
+
+    # The token is what stops other users on the machine from driving the
+    # TiVo, so the file must never be readable by them, not even briefly.
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({ "port"  : port,
+                    "pid"   : os.getpid(),
+                    "token" : token }, f)
+
+    os.replace(temp_path, path)
+    return token
+
+def withdraw(path=None):
+    """Forgets about this process being the running instance."""
+    path = path or instance_path()
+    instance = load_json(path, {})
+
+    if instance.get("pid") == os.getpid():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def forward(request, timeout=2.0):
+    """
+    Sends `request` (a dict) to the running instance and returns its reply,
+    or None if there is no running instance.
+    """
+    instance = load_json(instance_path(), {})
+
+    if "port" not in instance:
+        return None
+
+    request = dict(request, token=instance.get("token"))
+
+    try:
+        with socket.create_connection(('127.0.0.1', instance["port"]),
+                                      timeout) as s:
+            s.sendall(json.dumps(request).encode('utf-8') + b"\n")
+
+            with s.makefile('r', encoding='utf-8') as f:
+                reply = f.readline()
+    except OSError:
+        # Left behind by an instance that didn't exit cleanly.
+        return None
+
+    try:
+        return json.loads(reply)
+    except ValueError:
+        return None
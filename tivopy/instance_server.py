@@ -0,0 +1,79 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+import json
+
+from PySide2.QtCore import QObject, Signal
+from PySide2.QtNetwork import QHostAddress, QTcpServer
+
+from .instance import publish, withdraw
+
+class InstanceServer(QObject):
+    """Accepts requests forwarded by later invocations of TiVoPy."""
+    show_requested = Signal()
+
+    def __init__(self, dispatch):
+        super(InstanceServer, self).__init__()
+
+        # Called with each forwarded command, returns an error code or None.
+        self.dispatch = dispatch
+
+        self.server = QTcpServer(self)
+        self.server.newConnection.connect(self.accept)
+
+        self.token = None
+
+        if self.server.listen(QHostAddress.LocalHost):
+            self.token = publish(self.server.serverPort())
+        else:
+            print("Unable to listen for forwarded commands: "
+                  f"{self.server.errorString()}")
+
+    def accept(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            socket.readyRead.connect(lambda s=socket: self.handle_read(s))
+            socket.disconnected.connect(socket.deleteLater)
+
+    def handle_read(self, socket):
+        if not socket.canReadLine():
+            return
+
+        try:
+            request = json.loads(bytes(socket.readLine()).decode('utf-8'))
+        except ValueError:
+            request = {}
+
+        if not isinstance(request, dict) or \
+           request.get("token") != self.token:
+            reply = { "ok" : False, "error" : "FORBIDDEN" }
+        elif request.get("show"):
+            self.show_requested.emit()
+            reply = { "ok" : True }
+        elif isinstance(request.get("command"), str):
+            error = self.dispatch(request["command"])
+
+            if error:
+                reply = { "ok" : False, "error" : error }
+            else:
+                reply = { "ok" : True }
+        else:
+            reply = { "ok" : False, "error" : "INVALID_REQUEST" }
+
+        socket.write(json.dumps(reply).encode('utf-8') + b"\n")
+        socket.disconnectFromHost()
+
+    def close(self):
+        self.server.close()
+        withdraw()
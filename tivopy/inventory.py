@@ -0,0 +1,343 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+from .config import cache_path, load_json, save_json
+from .protocol import PORT
+
+# Found on the network by Zeroconf.
+DISCOVERED = "discovered"
+
+# Entered by hand, or added from the command line.
+STATIC = "static"
+
+class Device:
+    """A TiVo that we know of."""
+    def __init__(self, name, address, port=PORT, device_id=None,
+                 addresses=None, model=None, tags=(), location=None,
+                 origin=STATIC):
+        self.name = name
+
+        # The address we connect to. A TiVo with more than one network
+        # interface can have other addresses as well.
+        self.address = address
+        self.addresses = list(addresses or [address])
+
+        if address not in self.addresses:
+            self.addresses.insert(0, address)
+
+        # Only ever something other than 31339 for simulated TiVos.
+        self.port = port
+
+        # Stays the same when the TiVo's address changes: the TSN if the TiVo
+        # has been discovered, otherwise the key it was first known by.
+        self.id = device_id or self.key
+
+        self.model = model
+        self.tags = set(tags)
+        self.location = location
+        self.origin = origin
+
+    @property
+    def key(self):
+        """Uniquely identifies the TiVo, even if several share an address."""
+        return self.key_of(self.address)
+
+    def key_of(self, address):
+        if self.port == PORT:
+            return address
+
+        return f"{address}:{self.port}"
+
+    @property
+    def keys(self):
+        """The keys of every address the TiVo has."""
+        return [self.key_of(address) for address in self.addresses]
+
+    def to_dict(self):
+        return { "id"        : self.id,
+                 "name"      : self.name,
+                 "address"   : self.address,
+                 "addresses" : self.addresses,
+                 "port"      : self.port,
+                 "model"     : self.model,
+                 "tags"      : sorted(self.tags),
+                 "location"  : self.location,
+                 "origin"    : self.origin }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("name", "unknown"),
+                   data["address"],
+                   data.get("port", PORT),
+                   data.get("id"),
+                   data.get("addresses"),
+                   data.get("model"),
+                   data.get("tags", ()),
+                   data.get("location"),
+                   data.get("origin", DISCOVERED))
+
+def find_device(text, devices):
+    """
+    Finds a TiVo by id, name or key in `devices` (an Inventory, or a dict),
+    or builds one from an address. Raises ValueError if the address has a
+    port that isn't a port number.
+    """
+    device = devices.get(text)
+
+    if device is not None:
+        return device
+
+    # Only IPv4 addresses and host names can carry a port, IPv6 addresses
+    # have colons of their own.
+    if text.count(':') == 1:
+        address, port = text.split(':')
+        port = int(port)
+
+        if not 0 <= port <= 65535:
+            raise ValueError(f"{port} isn't a port number")
+
+        return Device("unknown", address, port)
+
+    return Device("unknown", text, PORT)
+
+def add_to_index(index, value, device_id):
+    if value is not None:
+        index.setdefault(value, set()).add(device_id)
+
+def remove_from_index(index, value, device_id):
+    ids = index.get(value)
+
+    if ids is not None:
+        ids.discard(device_id)
+
+        if not ids:
+            del index[value]
+
+class Inventory:
+    """
+    Every TiVo we've ever discovered or connected to, kept on disk.
+
+    TiVos are indexed by id, by the key of each of their addresses, and by
+    name, tag, model and location, so that finding them never means looking
+    through the whole fleet.
+    """
+    def __init__(self, path=None):
+        self.path = path or cache_path('inventory.json')
+
+        self.replace(Device.from_dict(data)
+                     for data in load_json(self.path, []))
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def __len__(self):
+        return len(self.devices)
+
+    def index(self, device):
+        for key in device.keys:
+            self.by_key[key] = device
+
+        add_to_index(self.by_name, device.name, device.id)
+        add_to_index(self.by_model, device.model, device.id)
+        add_to_index(self.by_location, device.location, device.id)
+
+        for tag in device.tags:
+            add_to_index(self.by_tag, tag, device.id)
+
+    def unindex(self, device):
+        for key in device.keys:
+            if self.by_key.get(key) is device:
+                del self.by_key[key]
+
+        remove_from_index(self.by_name, device.name, device.id)
+        remove_from_index(self.by_model, device.model, device.id)
+        remove_from_index(self.by_location, device.location, device.id)
+
+        for tag in device.tags:
+            remove_from_index(self.by_tag, tag, device.id)
+
+    def add(self, device):
+        """Adds a TiVo, replacing any with the same id."""
+        known = self.devices.get(device.id)
+
+        if known is not None:
+            self.unindex(known)
+
+        self.devices[device.id] = device
+        self.index(device)
+
+    def remove(self, device):
+        if self.devices.pop(device.id, None) is not None:
+            self.unindex(device)
+
+    def replace(self, devices):
+        """Replaces every TiVo in the inventory with `devices`."""
+        # Keyed by Device.id.
+        self.devices = {}
+
+        # Device.keys to Device.
+        self.by_key = {}
+
+        # Names, tags, models and locations to sets of Device.id.
+        self.by_name = {}
+        self.by_tag = {}
+        self.by_model = {}
+        self.by_location = {}
+
+        for device in devices:
+            self.add(device)
+
+    def get(self, text):
+        """Finds a TiVo by id, key or name, or returns None."""
+        device = self.devices.get(text) or self.by_key.get(text)
+
+        if device is not None:
+            return device
+
+        ids = self.by_name.get(text)
+
+        if ids:
+            return self.devices[next(iter(ids))]
+
+        return None
+
+    def query(self, tags=(), model=None, location=None, origin=None):
+        """
+        Returns every TiVo with all of `tags`, and the given model, location
+        and origin if they aren't None, sorted by name.
+        """
+        sets = [self.by_tag.get(tag, set()) for tag in tags]
+
+        if model is not None:
+            sets.append(self.by_model.get(model, set()))
+
+        if location is not None:
+            sets.append(self.by_location.get(location, set()))
+
+        if sets:
+            # Starting from the smallest set keeps this proportional to the
+            # number of matches rather than the size of the fleet.
+            sets.sort(key=len)
+            ids = set(sets[0]).intersection(*sets[1:])
+            devices = [self.devices[device_id] for device_id in ids]
+        else:
+            devices = list(self)
+
+        if origin is not None:
+            devices = [device for device in devices if device.origin == origin]
+
+        return sorted(devices, key=lambda device: (device.name, device.key))
+
+    def update(self, device, **changes):
+        """
+        Changes the attributes of a TiVo, keeping the indexes up to date.
+        Returns True if anything changed.
+        """
+        changes = { name : value for name, value in changes.items()
+                    if getattr(device, name) != value }
+
+        if not changes:
+            return False
+
+        self.unindex(device)
+
+        if "id" in changes:
+            del self.devices[device.id]
+            self.devices[changes["id"]] = device
+
+        for name, value in changes.items():
+            setattr(device, name, value)
+
+        self.index(device)
+        return True
+
+    def merge(self, name, addresses, port=PORT, model=None, device_id=None,
+              origin=DISCOVERED):
+        """
+        Merges a TiVo found by discovery into the inventory: an existing
+        entry with the same id, or any of the same addresses, is updated,
+        otherwise a new one is added. Returns True if anything changed.
+
+        Only what identifies a TiVo is merged: addresses it's already known
+        by are left in the order they're in, however discovery ranks them.
+        """
+        known = self.devices.get(device_id) if device_id else None
+
+        for address in addresses:
+            if known is not None:
+                break
+
+            known = self.by_key.get(Device(name, address, port).key)
+
+            # An address that now belongs to another TiVo, with an id of its
+            # own, rather than one whose id we haven't learnt yet.
+            if known is not None and device_id and \
+               known.id not in known.keys:
+                known = None
+
+        if known is None:
+            self.add(Device(name,
+                            addresses[0],
+                            port,
+                            device_id,
+                            addresses,
+                            model,
+                            origin=origin))
+            return True
+
+        changes = {}
+
+        # Manually entered addresses have no name, so they never replace one
+        # we already know.
+        if name != "unknown":
+            changes["name"] = name
+
+        if model is not None:
+            changes["model"] = model
+
+        # Found by address, an entry made before the TiVo's id was known.
+        if device_id:
+            changes["id"] = device_id
+
+        # A TiVo entered by hand that has since been discovered.
+        if origin == DISCOVERED:
+            changes["origin"] = DISCOVERED
+
+        # The addresses just discovered come first, the TiVo is most likely
+        # to be reachable on those.
+        if not set(addresses).issubset(known.addresses):
+            changes["addresses"] = list(addresses) + \
+                [address for address in known.addresses
+                 if address not in addresses]
+
+            if known.address not in addresses:
+                changes["address"] = addresses[0]
+
+        return self.update(known, **changes)
+
+    def remember(self, name, address, port=PORT, model=None, device_id=None):
+        """
+        Merges a single TiVo into the inventory, saving it if anything
+        changed. TiVos without a name were entered by hand.
+        """
+        origin = STATIC if name == "unknown" else DISCOVERED
+
+        if self.merge(name, [address], port, model, device_id, origin):
+            self.save()
+
+    def save(self):
+        try:
+            save_json(self.path, [device.to_dict() for device in self])
+        except OSError as e:
+            print(f"Unable to save {self.path}: {e}")
@@ -0,0 +1,201 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""
+Runs a stream of JSON lines jobs against TiVos.
+
+Each input line is an object such as:
+
+    {"id": 1, "device": "192.168.1.10", "command": "IRCODE PAUSE"}
+    {"id": 2, "device": "lobby-1", "macro": ["IRCODE LIVETV", "SETCH 702"],
+     "deadline": 1600000000.0}
+
+`device` is an inventory name or key ("address" or "address:port"),
+`macro` may also be a single string of commands separated by semicolons,
+and `deadline` is a time in seconds since the epoch after which the job is
+no longer worth running. One result line is written per job, in the order
+they complete.
+
+Input is only read while there is room for more work, so memory use doesn't
+depend on the length of the input.
+"""
+
+import asyncio
+import json
+from itertools import islice
+from time import perf_counter, time
+
+from .aio_client import TiVoError
+from .fleet import execute
+from .groups import parse_macro
+from .inventory import find_device
+
+class InvalidJob(Exception):
+    """Raised when an input line can't be understood."""
+
+def parse_job(line, devices):
+    """Returns (id, device, commands, deadline) for an input line."""
+    try:
+        job = json.loads(line)
+        device = find_device(str(job["device"]), devices)
+    except (ValueError, KeyError, TypeError):
+        raise InvalidJob()
+
+    if not isinstance(job, dict):
+        raise InvalidJob()
+
+    macro = job.get("macro", job.get("command"))
+
+    if isinstance(macro, str):
+        commands = parse_macro(macro)
+    elif isinstance(macro, list):
+        commands = [str(command) for command in macro]
+    else:
+        raise InvalidJob()
+
+    # The protocol is ASCII only, anything else can't even be sent.
+    if not all(command.isascii() for command in commands):
+        raise InvalidJob()
+
+    deadline = job.get("deadline")
+
+    if deadline is not None and not isinstance(deadline, (int, float)):
+        raise InvalidJob()
+
+    return job.get("id"), device, commands, deadline
+
+class JobRunner:
+    """Runs jobs with bounded in-flight work, overall and per TiVo."""
+    def __init__(self, pool, output, max_in_flight=256, per_device=1,
+                 timeout=5.0, devices=None):
+        self.pool = pool
+        self.output = output
+
+        # The longest a single job may take, in seconds.
+        self.timeout = timeout
+
+        # An Inventory, or a dict of names and keys to Device.
+        self.devices = devices or {}
+
+        # Limits the number of jobs that have been read but not finished.
+        self.slots = asyncio.Semaphore(max_in_flight)
+
+        # Per TiVo semaphores, only kept while the TiVo has work.
+        self.per_device = per_device
+        self.device_slots = {}
+
+        self.succeeded = 0
+        self.failed = 0
+
+    def write(self, result):
+        self.output.write(json.dumps(result) + "\n")
+        self.output.flush()
+
+        if result["ok"]:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+    async def run_job(self, job_id, device, commands, deadline):
+        """Runs a single job and writes its result."""
+        start = perf_counter()
+        result = { "id" : job_id, "device" : device.key }
+
+        entry = self.device_slots.get(device.key)
+
+        if entry is None:
+            entry = self.device_slots[device.key] = \
+                [asyncio.Semaphore(self.per_device), 0]
+
+        entry[1] += 1
+
+        async def attempt():
+            async with entry[0]:
+                async with self.pool.lease(device) as client:
+                    return await execute(client,
+                                         commands,
+                                         self.pool.timeouts.ack)
+
+        try:
+            # Waiting for the TiVo to be free, and for its connection, count
+            # against the job's time as much as the commands themselves.
+            timeout = self.timeout
+
+            if deadline is not None:
+                timeout = min(timeout, deadline - time())
+
+                if timeout <= 0:
+                    raise TiVoError("DEADLINE_EXCEEDED", device.address)
+
+            detail = await asyncio.wait_for(attempt(), timeout)
+            result.update(ok=True, result=detail)
+        except TiVoError as e:
+            result.update(ok=False, error=e.code)
+        except asyncio.TimeoutError:
+            result.update(ok=False, error="TIMEOUT")
+        except OSError as e:
+            result.update(ok=False, error=str(e))
+        finally:
+            entry[1] -= 1
+
+            if entry[1] == 0:
+                del self.device_slots[device.key]
+
+            self.slots.release()
+
+        result["elapsed_ms"] = round((perf_counter() - start) * 1000, 3)
+        self.write(result)
+
+    async def run(self, stream):
+        """Runs every job read from `stream` (a file object)."""
+        loop = asyncio.get_event_loop()
+        tasks = set()
+        line_number = 0
+
+        while True:
+            # Read a handful of lines at a time so the thread hop doesn't
+            # dominate. Those waiting for room are the only input held
+            # beyond the jobs in flight.
+            lines = await loop.run_in_executor(None,
+                                               lambda: list(islice(stream,
+                                                                   64)))
+
+            if not lines:
+                break
+
+            for line in lines:
+                line_number += 1
+
+                if not line.strip():
+                    continue
+
+                await self.slots.acquire()
+
+                try:
+                    job_id, device, commands, deadline = \
+                        parse_job(line, self.devices)
+                except InvalidJob:
+                    self.slots.release()
+                    self.write({ "line"  : line_number,
+                                 "ok"    : False,
+                                 "error" : "INVALID_JOB" })
+                    continue
+
+                task = asyncio.ensure_future(
+                    self.run_job(job_id, device, commands, deadline))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.wait(tasks)
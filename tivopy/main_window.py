@@ -12,7 +12,7 @@
 # OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
 # PERFORMANCE OF THIS SOFTWARE.
 
-from PySide2.QtCore import Signal, Slot, QPoint, Qt
+from PySide2.QtCore import Signal, Slot, QPoint, Qt, QTimer
 from PySide2.QtGui import QMouseEvent, QPixmap
 from PySide2.QtWidgets import (QAction,
                                QLabel,
@@ -59,6 +59,32 @@ class MainWindow(QLabel):
         self.change_channel = QAction("Change channel...", self)
         self.input_text = QAction("Input text...", self)
 
+        self.send_to_group = QAction("Send to group...", self)
+
+        # Mirror mode, where other TiVos follow the channel of this one.
+        self.mirror_tivo = QAction("Mirror this TiVo to...", self)
+        self.stop_mirroring = QAction("Stop mirroring", self)
+        self.mirror_status = QAction(self)
+        self.mirror_status.setEnabled(False)
+        self.update_mirror_status(None)
+
+        # When enabled, the number buttons are buffered locally and sent as a
+        # single SETCH command instead of one IRCODE per digit, which saves
+        # waiting for the TiVo's own inter-digit timeout.
+        self.fast_channel_entry = QAction("Fast channel entry", self)
+        self.fast_channel_entry.setCheckable(True)
+        self.fast_channel_entry.toggled.connect(lambda checked:
+                                                self.clear_digits())
+
+        # The digits typed so far while in fast channel entry mode.
+        self.digits = ""
+
+        # Sends the buffered digits once the user stops typing.
+        self.digit_timer = QTimer(self)
+        self.digit_timer.setSingleShot(True)
+        self.digit_timer.setInterval(1000)
+        self.digit_timer.timeout.connect(self.send_digits)
+
         # We care about ALL movements of the user, regardless of whether or not
         # they're pressing buttons.
         self.setMouseTracking(True)
@@ -364,16 +390,61 @@ class MainWindow(QLabel):
         if self.current_button:
             # The user is pressing a button, dispatch the command string for
             # it.
-            self.command_requested.emit(self.current_button["cmd"])
+            self.press_button(self.current_button)
 
     def keyPressEvent(self, event):
         """Called when the user presses a key on the keyboard."""
 
         for button in self.buttons:
             if button["key"] == event.key():
-              self.command_requested.emit(button["cmd"])
+              self.press_button(button)
               break
 
+    def press_button(self, button):
+        """Dispatches the command for a button, buffering digits if needed."""
+        command = button["cmd"]
+
+        if self.fast_channel_entry.isChecked():
+            if command.startswith("IRCODE NUM"):
+                self.digits += command[-1]
+
+                # Channel numbers are at most 4 digits long, there's no point
+                # in waiting for more.
+                if len(self.digits) == 4:
+                    self.send_digits()
+                else:
+                    self.digit_timer.start()
+                return
+
+            if self.digits:
+                if command == "IRCODE ENTER":
+                    self.send_digits()
+                    return
+
+                if command == "IRCODE CLEAR":
+                    self.clear_digits()
+                    return
+
+                # Any other button ends the channel entry first.
+                self.send_digits()
+
+        self.command_requested.emit(command)
+
+    @Slot()
+    def send_digits(self):
+        """Sends the buffered digits as a single channel change."""
+        self.digit_timer.stop()
+
+        if self.digits:
+            self.command_requested.emit(f"SETCH {self.digits}")
+            self.digits = ""
+
+    @Slot()
+    def clear_digits(self):
+        """Discards any buffered digits."""
+        self.digit_timer.stop()
+        self.digits = ""
+
     @Slot(QPoint)
     def on_context_menu(self, point):
         """Called when the mouse is right clicked on the remote control."""
@@ -383,6 +454,13 @@ class MainWindow(QLabel):
         menu.addAction(self.select_tivo)
         menu.addAction(self.input_text)
         menu.addAction(self.change_channel)
+        menu.addSeparator()
+        menu.addAction(self.send_to_group)
+        menu.addAction(self.mirror_tivo)
+        menu.addAction(self.stop_mirroring)
+        menu.addAction(self.mirror_status)
+        menu.addSeparator()
+        menu.addAction(self.fast_channel_entry)
         menu.exec_(self.mapToGlobal(point))
 
     def update_channel(self, channel):
@@ -390,4 +468,15 @@ class MainWindow(QLabel):
         Updates the information specifying to the user what channel their TiVo
         is currently tuned into.
         """
-        self.current_channel.setText(f"Current channel: {channel}")
\ No newline at end of file
+        self.current_channel.setText(f"Current channel: {channel}")
+
+    def update_mirror_status(self, status):
+        """
+        Updates the information specifying to the user which TiVos are
+        following this one, or hides it if mirror mode is off.
+        """
+        self.mirror_status.setVisible(status is not None)
+        self.stop_mirroring.setVisible(status is not None)
+
+        if status is not None:
+            self.mirror_status.setText(status)
@@ -0,0 +1,155 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+from time import perf_counter
+
+from PySide2.QtCore import QObject, Signal, Slot
+
+from .tivo_client import TiVoClient
+
+class Mirror(QObject):
+    """
+    Makes any number of follower TiVos follow the channel of a leader TiVo.
+
+    The leader is an existing client; every time it reports a channel change
+    the same channel is set on each follower. The time between the leader's
+    report and each follower's confirmation is measured.
+    """
+    # Follower IP address, propagation delay in milliseconds.
+    propagated = Signal(str, float)
+
+    # Follower IP address, error code.
+    failed = Signal(str, str)
+
+    def __init__(self, leader, addresses, device_states, capabilities):
+        super(Mirror, self).__init__()
+
+        self.leader = leader
+        self.leader.channel_changed.connect(self.leader_changed)
+
+        self.followers = {}
+
+        # Changes sent to followers that haven't been confirmed yet, keyed by
+        # IP address. Each value is (command, time sent).
+        self.pending = {}
+
+        # Every measured delay in milliseconds, keyed by IP address.
+        self.delays = {}
+
+        for ip in addresses:
+            # Mirroring a TiVo to itself would be rather pointless.
+            if ip == leader.ip:
+                continue
+
+            # Follower connections are opened up front and kept open, so
+            # that a channel change only costs a single write.
+            client = TiVoClient(ip,
+                                device_states.get(ip),
+                                capabilities.get(ip))
+
+            client.stay_connected()
+            client.channel_changed.connect(
+                lambda channel, ip=ip: self.follower_changed(ip))
+            client.error_message.connect(
+                lambda error, ip=ip: self.follower_failed(ip, error))
+
+            self.followers[ip] = client
+            self.delays[ip] = []
+
+        # Bring the followers in line with the leader straight away if we
+        # already know where it is.
+        if self.leader.state.channel is not None:
+            self.leader_changed(self.leader.state.describe_channel())
+
+    def channel_command(self):
+        """Returns the SETCH command for the leader's current channel."""
+        state = self.leader.state
+
+        if state.subchannel:
+            return f"SETCH {state.channel} {state.subchannel}"
+
+        return f"SETCH {state.channel}"
+
+    @Slot(str)
+    def leader_changed(self, channel):
+        """Called when the leader reports a channel change."""
+        if self.leader.state.channel is None:
+            return
+
+        command = self.channel_command()
+        start = perf_counter()
+
+        for ip, client in self.followers.items():
+            # The follower is already there, there's nothing to measure.
+            if client.state.is_redundant(command):
+                self.pending.pop(ip, None)
+                continue
+
+            self.pending[ip] = (command, start)
+            client.send_command(command)
+
+    def follower_changed(self, ip):
+        """Called when a follower reports a channel change."""
+        if ip not in self.pending:
+            return
+
+        command, start = self.pending[ip]
+
+        # The follower may report some other change (i.e. a recording
+        # starting) before it gets to ours.
+        if not self.followers[ip].state.is_redundant(command):
+            return
+
+        del self.pending[ip]
+
+        delay = (perf_counter() - start) * 1000
+        self.delays[ip].append(delay)
+
+        print(f"Mirrored to {ip} in {delay:.1f} ms")
+        self.propagated.emit(ip, delay)
+
+    def follower_failed(self, ip, error):
+        """Called when a follower rejects a channel change."""
+        if self.pending.pop(ip, None) is None:
+            return
+
+        print(f"Unable to mirror to {ip}: {error}")
+        self.failed.emit(ip, error)
+
+    def report(self):
+        """
+        Returns the propagation delays measured so far, as a dictionary keyed
+        by IP address of (count, mean, max) in milliseconds.
+        """
+        report = {}
+
+        for ip, delays in self.delays.items():
+            if delays:
+                report[ip] = (len(delays),
+                              sum(delays) / len(delays),
+                              max(delays))
+            else:
+                report[ip] = (0, None, None)
+
+        return report
+
+    def stop(self):
+        """Stops mirroring and closes every follower connection."""
+        self.leader.channel_changed.disconnect(self.leader_changed)
+
+        for client in self.followers.values():
+            client.close()
+
+        self.followers.clear()
+        self.pending.clear()
@@ -0,0 +1,189 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+import asyncio
+from contextlib import asynccontextmanager
+
+from .aio_client import CONNECTION_ERRORS, AsyncTiVoClient, TiVoError
+from .breaker import OPEN, CircuitBreaker
+from .device_state import DeviceStates
+
+class Timeouts:
+    """How long to wait for each stage of talking to a TiVo, in seconds."""
+    def __init__(self, connect=5.0, send=5.0, ack=5.0):
+        # Opening the connection.
+        self.connect = connect
+
+        # Handing a command to the operating system. This only takes any
+        # time at all if the TiVo has stopped reading.
+        self.send = send
+
+        # The TiVo confirming a channel change.
+        self.ack = ack
+
+class ConnectionPool:
+    """
+    Keeps a single persistent connection open to each TiVo.
+
+    Connections are opened the first time a TiVo is used and reopened if
+    they're lost. Only one coroutine may use a connection at a time, as
+    responses can't otherwise be matched to the command that caused them.
+
+    Each TiVo also has a circuit breaker, so that once one stops responding
+    requests to it fail immediately instead of waiting out their timeouts.
+    """
+    def __init__(self, timeouts=None, capabilities=None, failure_threshold=3,
+                 reset_timeout=30.0):
+        self.timeouts = timeouts or Timeouts()
+
+        # Optional CapabilityCache consulted for every new connection.
+        self.capabilities = capabilities
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        # Outlives the connections, so what we know about a TiVo survives a
+        # reconnect.
+        self.states = DeviceStates()
+
+        # Device.key to AsyncTiVoClient.
+        self.clients = {}
+
+        # Device.key to asyncio.Lock.
+        self.locks = {}
+
+        # Device.key to CircuitBreaker.
+        self.breakers = {}
+
+        # Callables invoked as listener(device, response) for every response
+        # received on any connection.
+        self.listeners = []
+
+    def __len__(self):
+        return sum(1 for client in self.clients.values() if client.connected)
+
+    def breaker(self, device):
+        """Returns the circuit breaker of a TiVo."""
+        breaker = self.breakers.get(device.key)
+
+        if breaker is None:
+            breaker = self.breakers[device.key] = \
+                CircuitBreaker(self.failure_threshold, self.reset_timeout)
+
+        return breaker
+
+    def breaker_states(self):
+        """Describes every circuit breaker, keyed by Device.key."""
+        return { key : breaker.to_dict()
+                 for key, breaker in self.breakers.items() }
+
+    def open_breakers(self):
+        """Returns the number of TiVos currently being failed fast."""
+        return sum(1 for breaker in self.breakers.values()
+                   if breaker.state == OPEN)
+
+    async def connect(self, device):
+        """Returns an open connection to a TiVo."""
+        client = self.clients.get(device.key)
+
+        if client is not None and client.connected:
+            return client
+
+        capabilities = None
+
+        if self.capabilities is not None:
+            capabilities = self.capabilities.get(device.address)
+
+        client = AsyncTiVoClient(device.address,
+                                 device.port,
+                                 self.states.get(device.key),
+                                 capabilities,
+                                 self.timeouts.send)
+        await client.connect(self.timeouts.connect)
+
+        client.listeners.append(
+            lambda client, response: self.notify(device, response))
+
+        self.clients[device.key] = client
+        return client
+
+    def notify(self, device, response):
+        for listener in list(self.listeners):
+            listener(device, response)
+
+    @asynccontextmanager
+    async def lease(self, device):
+        """
+        Gives the caller exclusive use of the connection to a TiVo. Raises
+        TiVoError("CIRCUIT_OPEN") straight away if the TiVo has been failing.
+        """
+        breaker = self.breaker(device)
+
+        # Don't even queue up behind other requests for a TiVo that's down.
+        if breaker.state == OPEN:
+            raise TiVoError("CIRCUIT_OPEN", device.address)
+
+        lock = self.locks.get(device.key)
+
+        if lock is None:
+            lock = self.locks[device.key] = asyncio.Lock()
+
+        async with lock:
+            # The breaker may have opened while we were waiting.
+            if not breaker.allow():
+                raise TiVoError("CIRCUIT_OPEN", device.address)
+
+            recorded = False
+
+            try:
+                client = await self.connect(device)
+                yield client
+            except TiVoError as e:
+                # The TiVo refusing a command is no reason to drop the
+                # connection, not hearing back from it is.
+                if e.code in CONNECTION_ERRORS:
+                    await self.discard(device)
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+                recorded = True
+                raise
+            except (OSError, asyncio.TimeoutError):
+                await self.discard(device)
+                breaker.record_failure()
+
+                recorded = True
+                raise
+            else:
+                breaker.record_success()
+                recorded = True
+            finally:
+                # Cancelled half way through; let somebody else try.
+                if not recorded:
+                    breaker.trial = False
+
+    async def discard(self, device):
+        """Closes the connection to a TiVo."""
+        client = self.clients.pop(device.key, None)
+
+        if client is not None:
+            await client.close()
+
+    async def close(self):
+        """Closes every connection."""
+        clients, self.clients = self.clients, {}
+
+        for client in clients.values():
+            await client.close()
@@ -0,0 +1,96 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""Finds out whether TiVos can be reached, without the GUI."""
+
+import asyncio
+import ipaddress
+from time import perf_counter
+
+from .protocol import PORT
+from .ratelimit import TokenBucket
+
+async def probe(address, port=PORT, timeout=1.0):
+    """
+    Returns the seconds taken to open a connection to a TiVo, or None if it
+    couldn't be opened within `timeout` seconds.
+    """
+    start = perf_counter()
+
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(address, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+
+    rtt = perf_counter() - start
+    writer.close()
+
+    return rtt
+
+def rank_addresses(addresses, latencies):
+    """
+    Sorts addresses by how quickly they answered, followed by any not
+    probed yet and then any that couldn't be reached. `latencies` maps
+    addresses to seconds, or None for those that couldn't be reached.
+    """
+    def order(address):
+        if address not in latencies:
+            return (1, 0)
+
+        rtt = latencies[address]
+        return (2, 0) if rtt is None else (0, rtt)
+
+    return tuple(sorted(addresses, key=order))
+
+async def scan(network, on_hit=None, rate=1000.0, concurrency=256,
+               timeout=0.5):
+    """
+    Probes every host in `network` (such as "192.168.1.0/24") for a TiVo,
+    for networks where multicast doesn't get through. No more than `rate`
+    connections are started per second, and no more than `concurrency` are
+    in progress at once. `on_hit(address, rtt)` is called as soon as each
+    TiVo is found. Returns a list of (address, rtt).
+    """
+    bucket = TokenBucket(rate, min(rate, concurrency))
+    semaphore = asyncio.Semaphore(concurrency)
+    hits = []
+    tasks = set()
+
+    async def probe_host(address):
+        try:
+            rtt = await probe(address, timeout=timeout)
+        finally:
+            semaphore.release()
+
+        if rtt is not None:
+            hits.append((address, rtt))
+
+            if on_hit:
+                on_hit(address, rtt)
+
+    for host in ipaddress.ip_network(network, strict=False).hosts():
+        # Hosts are only taken from the network as there's room for them,
+        # so that scanning a large network doesn't mean a task per host.
+        await semaphore.acquire()
+        await bucket.acquire()
+
+        task = asyncio.ensure_future(probe_host(str(host)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.wait(tasks)
+
+    return hits
@@ -0,0 +1,104 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""
+Pieces of the TiVo version 1.1 TCP Remote Protocol that don't depend on any
+particular networking library.
+
+This module must never import PySide2, it is shared between the GUI and the
+headless tools.
+"""
+
+# TiVos *always* serve on port 31339.
+PORT = 31339
+
+def encode_command(command):
+    """Converts a command string into the bytes sent over the wire."""
+    # All commands are terminated with a carriage return. The end user
+    # shouldn't have to care about this detail.
+    return bytes(command + "\r", encoding='ascii')
+
+def normalize_channel(channel):
+    """
+    Returns a channel number in a form suitable for comparison.
+
+    The TiVo reports channels zero padded to 4 digits ("0702"), while the user
+    is free to type "702".
+    """
+    if channel is None:
+        return None
+
+    channel = str(channel).strip()
+
+    if channel.isdigit():
+        return str(int(channel))
+
+    return channel
+
+class Response:
+    """A single message received from a TiVo."""
+    def __init__(self, kind, channel=None, subchannel=None, reason=None):
+        # The first word of the message, i.e. "CH_STATUS".
+        self.kind = kind
+
+        # Only present for CH_STATUS messages.
+        self.channel = channel
+        self.subchannel = subchannel
+
+        # For CH_STATUS this is why the channel changed (LOCAL, REMOTE,
+        # RECORDING), for CH_FAILED this is the error code.
+        self.reason = reason
+
+    def __repr__(self):
+        return f"Response({self.kind!r}, {self.channel!r}, " \
+               f"{self.subchannel!r}, {self.reason!r})"
+
+def parse_response(line):
+    """Parameterizes a single line received from a TiVo."""
+    data = line.split()
+
+    if not data:
+        return None
+
+    if data[0] == "CH_STATUS":
+        # CH_STATUS <channel> [<subchannel>] <reason>
+        if len(data) >= 4:
+            return Response(data[0], data[1], data[2], data[3])
+        if len(data) == 3:
+            return Response(data[0], data[1], reason=data[2])
+        if len(data) == 2:
+            return Response(data[0], data[1])
+    elif data[0] == "CH_FAILED" and len(data) >= 2:
+        return Response(data[0], reason=data[1])
+
+    return Response(data[0])
+
+class LineBuffer:
+    """
+    Splits the stream of bytes received from a TiVo into complete lines.
+
+    A single read may contain several messages, or only part of one, so data
+    is accumulated until a line terminator shows up.
+    """
+    def __init__(self):
+        self.pending = b""
+
+    def feed(self, data):
+        """Adds data read from the socket, returning every complete line."""
+        self.pending += data.replace(b"\n", b"\r")
+
+        *lines, self.pending = self.pending.split(b"\r")
+
+        return [line.decode('utf-8', 'replace').strip()
+                for line in lines if line.strip()]
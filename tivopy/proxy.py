@@ -0,0 +1,253 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""
+A proxy that speaks the TCP Remote Protocol itself, letting any number of
+programs share a single connection to a TiVo.
+
+TiVos only accept a handful of remote control connections at once. Pointing
+existing tools at the proxy instead of the TiVo lets them work unchanged,
+while the TiVo only ever sees one connection.
+"""
+
+import asyncio
+from collections import deque
+from time import monotonic
+
+from .protocol import LineBuffer
+
+# Downstream clients whose unsent data grows beyond this many bytes aren't
+# reading what we send them, and are disconnected.
+MAX_CLIENT_BUFFER = 1024 * 1024
+
+# Commands the TiVo answers, and the lines it answers them with. Everything
+# else is acted on silently.
+REPLIES = { "SETCH"           : ("CH_STATUS", "CH_FAILED"),
+            "FORCECH"         : ("CH_STATUS", "CH_FAILED"),
+            "TELEPORT LIVETV" : ("LIVETV_READY",) }
+
+# Seconds after which we stop expecting the TiVo to answer a command.
+REPLY_TIMEOUT = 5.0
+
+def replies_to(command):
+    """Returns the lines that may answer `command`, if any."""
+    words = command.split()
+
+    return REPLIES.get(" ".join(words[:2])) or \
+           REPLIES.get(" ".join(words[:1])) or ()
+
+class Downstream:
+    """A program connected to the proxy."""
+    def __init__(self, writer, queue_size):
+        self.writer = writer
+
+        # Commands waiting for their turn to be sent to the TiVo. When full,
+        # we stop reading from the client until there's room.
+        self.queue = asyncio.Queue(queue_size)
+
+    def send(self, line):
+        """Sends a line to the client, returning False if it's stuck."""
+        transport = self.writer.transport
+
+        if transport.is_closing() or \
+           transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+            return False
+
+        self.writer.write(line.encode('utf-8') + b"\r")
+        return True
+
+class MultiplexProxy:
+    """Shares one upstream connection to a TiVo between many clients."""
+    def __init__(self, device, queue_size=64, reconnect_interval=2.0,
+                 connect_timeout=5.0):
+        self.device = device
+        self.queue_size = queue_size
+        self.reconnect_interval = reconnect_interval
+        self.connect_timeout = connect_timeout
+
+        # In order of connection, which is the order they take turns in.
+        self.clients = []
+
+        # Clients waiting for an answer, in the order their commands were
+        # sent, as (client, replies, deadline) tuples. Answers go to the
+        # first client waiting for one of their kind, and nobody else.
+        self.waiting = deque()
+
+        # The most recent CH_STATUS line, replayed to new clients just as
+        # the TiVo itself does when a connection is opened.
+        self.last_status = None
+
+        self.upstream = None
+        self.connected = asyncio.Event()
+
+        # Set whenever a client has queued a command.
+        self.ready = asyncio.Event()
+
+        self.server = None
+        self.tasks = []
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self.handle_client,
+                                                 host,
+                                                 port)
+        self.tasks = [asyncio.ensure_future(self.upstream_loop()),
+                      asyncio.ensure_future(self.writer_loop())]
+
+        return self.server
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def upstream_loop(self):
+        """Keeps the connection to the TiVo open, relaying what it sends."""
+        while True:
+            try:
+                reader, self.upstream = await asyncio.wait_for(
+                    asyncio.open_connection(self.device.address,
+                                            self.device.port),
+                    self.connect_timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                print(f"Unable to connect to {self.device.key}: {e}")
+                await asyncio.sleep(self.reconnect_interval)
+                continue
+
+            print(f"Connected to {self.device.key}")
+            self.connected.set()
+
+            lines = LineBuffer()
+
+            try:
+                while True:
+                    data = await reader.read(4096)
+
+                    if not data:
+                        break
+
+                    for line in lines.feed(data):
+                        self.relay(line)
+            except OSError:
+                pass
+            finally:
+                self.connected.clear()
+                self.upstream.close()
+                self.upstream = None
+
+            print(f"Lost connection to {self.device.key}")
+            await asyncio.sleep(self.reconnect_interval)
+
+    def relay(self, line):
+        """Passes a line from the TiVo on to the right clients."""
+        kind = line.split()[0] if line.split() else ""
+        sender = self.waiting_for(kind)
+
+        if kind == "CH_STATUS" or sender is None:
+            # Everybody wants to know about channel changes, and there's
+            # no telling who anything unexpected is meant for.
+            if kind == "CH_STATUS":
+                self.last_status = line
+
+            recipients = list(self.clients)
+        elif sender in self.clients:
+            recipients = [sender]
+        else:
+            # It asked, then left.
+            recipients = []
+
+        for client in recipients:
+            if not client.send(line):
+                client.writer.close()
+
+    def waiting_for(self, kind):
+        """
+        Returns the client that has waited longest for a line of `kind`,
+        and stops it waiting, or returns None.
+        """
+        now = monotonic()
+
+        while self.waiting and self.waiting[0][2] < now:
+            self.waiting.popleft()
+
+        for entry in self.waiting:
+            if kind in entry[1]:
+                self.waiting.remove(entry)
+                return entry[0]
+
+        return None
+
+    async def writer_loop(self):
+        """
+        Sends queued commands to the TiVo. Clients take turns, one command
+        each, so a chatty client can't starve the others.
+        """
+        while True:
+            await self.ready.wait()
+            await self.connected.wait()
+
+            sent = False
+
+            for client in list(self.clients):
+                if client.queue.empty():
+                    continue
+
+                command = client.queue.get_nowait()
+                self.upstream.write(command + b"\r")
+                sent = True
+
+                replies = replies_to(command.decode('utf-8'))
+
+                if replies:
+                    self.waiting.append((client,
+                                         replies,
+                                         monotonic() + REPLY_TIMEOUT))
+
+            if not sent:
+                self.ready.clear()
+                continue
+
+            try:
+                await self.upstream.drain()
+            except (OSError, AttributeError):
+                # The connection went away; upstream_loop() will reopen it.
+                pass
+
+    async def handle_client(self, reader, writer):
+        client = Downstream(writer, self.queue_size)
+        self.clients.append(client)
+
+        if self.last_status:
+            client.send(self.last_status)
+
+        lines = LineBuffer()
+
+        try:
+            while True:
+                data = await reader.read(4096)
+
+                if not data:
+                    break
+
+                for line in lines.feed(data):
+                    await client.queue.put(line.encode('utf-8'))
+                    self.ready.set()
+        except OSError:
+            pass
+        finally:
+            self.clients.remove(client)
+
+            writer.close()
@@ -0,0 +1,164 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""
+The TiVos found by discovery, shared between the thread that finds them and
+the threads that display them.
+"""
+
+import threading
+from collections import namedtuple
+
+from .capabilities import decode_txt
+
+# What happened to a TiVo, as passed to registry listeners.
+ADDED = "added"
+UPDATED = "updated"
+REMOVED = "removed"
+
+# A TiVo as discovery found it. `key` identifies the TiVo however many
+# services it advertises: its TSN, or failing that its name. TiVos
+# remembered from a previous run aren't `verified` until they've been seen
+# again, `last_seen` is a time in seconds since the epoch and `rtt` the
+# seconds taken to connect to the TiVo, if known. `latencies` maps each
+# address probed so far to its connection time, or None if it couldn't be
+# reached; `addresses` are kept in order of it, best first.
+DiscoveredTiVo = namedtuple("DiscoveredTiVo",
+                            "key name addresses port properties verified "
+                            "last_seen rtt latencies",
+                            defaults=(True, None, None, None))
+
+def tivo_to_dict(tivo):
+    """Converts a DiscoveredTiVo into something that can be sent as JSON."""
+    return { "key"        : tivo.key,
+             "name"       : tivo.name,
+             "addresses"  : list(tivo.addresses),
+             "port"       : tivo.port,
+             "properties" : decode_txt(tivo.properties),
+             "verified"   : tivo.verified,
+             "last_seen"  : tivo.last_seen,
+             "rtt"        : tivo.rtt,
+             "latencies"  : tivo.latencies }
+
+def tivo_from_dict(data):
+    """
+    The opposite of tivo_to_dict(). Raises KeyError or TypeError if `data`
+    is missing anything.
+    """
+    # Entries saved before services were merged are keyed by service name.
+    return DiscoveredTiVo(data.get("key") or data["service"],
+                          data["name"],
+                          tuple(data["addresses"]),
+                          data.get("port"),
+                          data.get("properties", {}),
+                          data.get("verified", True),
+                          data.get("last_seen"),
+                          data.get("rtt"),
+                          data.get("latencies"))
+
+class Snapshot:
+    """
+    The contents of the registry at a particular version. Snapshots never
+    change once published, so they can be read from any thread without
+    locking.
+    """
+    def __init__(self, version, by_key):
+        self.version = version
+        self.by_key = by_key
+
+        self.by_address = { address : tivo
+                            for tivo in by_key.values()
+                            for address in tivo.addresses }
+
+    def __iter__(self):
+        return iter(self.by_key.values())
+
+    def __len__(self):
+        return len(self.by_key)
+
+    def get(self, key):
+        return self.by_key.get(key)
+
+    def find(self, address):
+        """Returns the TiVo with `address`, or None."""
+        return self.by_address.get(address)
+
+    def listings(self, verified=False):
+        """
+        Returns a (name, address) pair for every address of every TiVo, or
+        only the verified ones.
+        """
+        return [(tivo.name, address)
+                for tivo in self
+                if tivo.verified or not verified
+                for address in tivo.addresses]
+
+class DeviceRegistry:
+    """
+    Discovered TiVos, keyed by TiVo and by address.
+
+    Writers copy the current snapshot, change the copy and publish it with
+    the next version number. Readers just take `snapshot`, and can skip any
+    work if its version is the one they saw last.
+    """
+    def __init__(self):
+        # Only writers take this, to keep from losing each other's changes.
+        self.lock = threading.Lock()
+
+        self.snapshot = Snapshot(0, {})
+
+        # Callables invoked as listener(event, tivo) after every change, on
+        # the thread that made it.
+        self.listeners = []
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    def publish(self, by_key):
+        self.snapshot = Snapshot(self.snapshot.version + 1, by_key)
+
+    def notify(self, event, tivo):
+        for listener in list(self.listeners):
+            listener(event, tivo)
+
+    def put(self, tivo):
+        """Adds or replaces a TiVo, returning the one it replaced, if any."""
+        with self.lock:
+            previous = self.snapshot.get(tivo.key)
+
+            if previous == tivo:
+                return previous
+
+            by_key = dict(self.snapshot.by_key)
+            by_key[tivo.key] = tivo
+            self.publish(by_key)
+
+        self.notify(ADDED if previous is None else UPDATED, tivo)
+        return previous
+
+    def remove(self, key):
+        """Removes a TiVo, returning it, or None if it wasn't there."""
+        with self.lock:
+            previous = self.snapshot.get(key)
+
+            if previous is None:
+                return None
+
+            by_key = dict(self.snapshot.by_key)
+            del by_key[key]
+            self.publish(by_key)
+
+        self.notify(REMOVED, previous)
+        return previous
@@ -0,0 +1,78 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+from PySide2.QtCore import Qt, Signal, Slot
+from PySide2.QtWidgets import (QDialog,
+                               QDialogButtonBox,
+                               QFormLayout,
+                               QLineEdit,
+                               QListWidget,
+                               QListWidgetItem)
+
+class SelectFollowers(QDialog):
+    """Allows the user to pick the TiVos that should mirror this one."""
+    followers_selected = Signal(list)
+
+    def __init__(self, tivos):
+        super(SelectFollowers, self).__init__()
+
+        self.setModal(True)
+
+        # Every TiVo we know of, the user checks the ones they want.
+        self.tivo_listings = QListWidget(self)
+
+        for name, ip_address in tivos:
+            item = QListWidgetItem(f"{name} ({ip_address})")
+            item.setData(Qt.UserRole, ip_address)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Unchecked)
+
+            self.tivo_listings.addItem(item)
+
+        # TiVos that weren't discovered can be typed in manually.
+        self.other_addresses = QLineEdit(self)
+        self.other_addresses.setPlaceholderText("Separated by commas")
+
+        self.button_boxes = QDialogButtonBox(QDialogButtonBox.Ok |
+                                             QDialogButtonBox.Cancel)
+
+        self.button_boxes.accepted.connect(self.accepted)
+        self.button_boxes.rejected.connect(lambda: self.close())
+
+        self.layout = QFormLayout(self)
+        self.layout.addRow("TiVos:", self.tivo_listings)
+        self.layout.addRow("Other IP addresses:", self.other_addresses)
+        self.layout.addRow(self.button_boxes)
+
+        self.setWindowTitle("Mirror this TiVo")
+        self.resize(384, 320)
+
+    @Slot()
+    def accepted(self):
+        addresses = []
+
+        for row in range(self.tivo_listings.count()):
+            item = self.tivo_listings.item(row)
+
+            if item.checkState() == Qt.Checked:
+                addresses.append(item.data(Qt.UserRole))
+
+        for address in self.other_addresses.text().split(','):
+            address = address.strip()
+
+            if address and address not in addresses:
+                addresses.append(address)
+
+        self.followers_selected.emit(addresses)
+        self.close()
@@ -18,34 +18,44 @@ from PySide2.QtWidgets import (QDialog,
                               QInputDialog,
                               QLabel,
                               QLineEdit,
-                              QTreeWidget,
-                              QTreeWidgetItem,
+                              QTreeView,
                               QVBoxLayout)
 
+from .tivo_list_model import RankedTiVos, TiVoListModel
+
 class SelectTiVoWidget(QDialog):
     """Displays the list of TiVos that were discovered on the network."""
 
     # Signals
     connect_to_tivo = Signal(str, str)
+    scan_requested = Signal(str)
 
     def __init__(self):
         super(SelectTiVoWidget, self).__init__()
 
-        self.tivos_found = []
+        self.tivos_found = TiVoListModel(self)
+        self.ranked_tivos = RankedTiVos(self.tivos_found, self)
 
         self.label = QLabel(self)
 
         self.label.setText('Below is a listing of all TiVos discovered on your'
-                           ' network, which will refresh every 5 seconds. If y'
-                           'ou do not see your TiVo, '
+                           ' network, which is kept up to date as TiVos come a'
+                           'nd go. If you do not see your TiVo, '
                            '<a href="#specify_ip">click here to specify an IP'
-                           ' address.</a>')
+                           ' address</a>, or <a href="#scan">scan a range of '
+                           'addresses</a> if it is on another network.')
+
+        self.label.linkActivated.connect(self.link_activated)
+
+        self.tivo_listings = QTreeView(self)
+        self.tivo_listings.setModel(self.ranked_tivos)
+        self.tivo_listings.setRootIsDecorated(False)
 
-        self.label.linkActivated.connect(self.specify_ip_address)
+        # Every row is the same height, which spares the view from measuring
+        # each of them when there are thousands.
+        self.tivo_listings.setUniformRowHeights(True)
 
-        self.tivo_listings = QTreeWidget(self)
-        self.tivo_listings.itemDoubleClicked.connect(self.tivo_selected)
-        self.tivo_listings.setHeaderLabels(["Name", "IP Address"])
+        self.tivo_listings.doubleClicked.connect(self.tivo_selected)
 
         self.layout = QVBoxLayout(self)
         self.layout.addWidget(self.label)
@@ -56,16 +66,34 @@ class SelectTiVoWidget(QDialog):
 
         self.setModal(True)
 
-    def add_tivo(self, name, ip_address):
-        item = QTreeWidgetItem()
-        item.setText(0, name)
-        item.setText(1, ip_address)
+    def update_tivo(self, tivo):
+        """Lists a discovered TiVo, updating its row if it's listed."""
+        self.tivos_found.update_tivo(tivo)
+
+    def remove_tivo(self, tivo):
+        self.tivos_found.remove_tivo(tivo)
+
+    def tivo_selected(self, index):
+        index = self.ranked_tivos.mapToSource(index)
+        tivo = self.tivos_found.tivo(index.row())
 
-        self.tivo_listings.addTopLevelItem(item)
-        self.tivos_found.append(item)
+        if tivo.addresses:
+            self.connect_to_tivo.emit(tivo.name, tivo.addresses[0])
+
+    def link_activated(self, link):
+        if link == "#scan":
+            self.specify_network()
+        else:
+            self.specify_ip_address(link)
+
+    def specify_network(self):
+        text, ok = QInputDialog().getText(self,
+                                          "Scan for TiVos",
+                                          "Network (i.e. 192.168.1.0/24):",
+                                          QLineEdit.Normal)
 
-    def tivo_selected(self, item, column):
-        self.connect_to_tivo.emit(item.text(0), item.text(1))
+        if ok and text.strip():
+            self.scan_requested.emit(text.strip())
 
     def specify_ip_address(self, link):
         text, ok = QInputDialog().getText(self,
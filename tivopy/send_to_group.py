@@ -0,0 +1,84 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+from PySide2.QtCore import Signal, Slot
+from PySide2.QtWidgets import (QComboBox,
+                               QDialog,
+                               QDialogButtonBox,
+                               QFormLayout,
+                               QLineEdit)
+
+from .groups import parse_macro
+
+class SendToGroup(QDialog):
+    """Allows the user to send a command or macro to a group of TiVos."""
+    # Group name, IP addresses, commands.
+    send_to_group = Signal(str, list, list)
+
+    def __init__(self, groups):
+        super(SendToGroup, self).__init__()
+
+        self.setModal(True)
+
+        self.groups = groups
+
+        # Picking an existing group fills in its members, typing a new name
+        # creates a group.
+        self.group = QComboBox(self)
+        self.group.setEditable(True)
+        self.group.addItems(groups.names())
+        self.group.currentTextChanged.connect(self.group_changed)
+
+        self.members = QLineEdit(self)
+        self.members.setPlaceholderText("IP addresses, separated by commas")
+
+        self.commands = QLineEdit(self)
+        self.commands.setPlaceholderText("i.e. IRCODE PAUSE, or a macro "
+                                         "separated by semicolons")
+
+        self.button_boxes = QDialogButtonBox(QDialogButtonBox.Ok |
+                                             QDialogButtonBox.Cancel)
+
+        self.button_boxes.accepted.connect(self.accepted)
+        self.button_boxes.rejected.connect(lambda: self.close())
+
+        self.layout = QFormLayout(self)
+        self.layout.addRow("Group:", self.group)
+        self.layout.addRow("Members:", self.members)
+        self.layout.addRow("Command:", self.commands)
+        self.layout.addRow(self.button_boxes)
+
+        self.group_changed(self.group.currentText())
+
+        self.setWindowTitle("Send to group")
+        self.resize(384, 120)
+
+    @Slot(str)
+    def group_changed(self, name):
+        if name in self.groups.names():
+            self.members.setText(", ".join(self.groups.get(name)))
+
+    @Slot()
+    def accepted(self):
+        name = self.group.currentText().strip()
+        addresses = [address.strip()
+                     for address in self.members.text().split(',')
+                     if address.strip()]
+        commands = parse_macro(self.commands.text())
+
+        if not name or not addresses or not commands:
+            return
+
+        self.send_to_group.emit(name, addresses, commands)
+        self.close()
@@ -0,0 +1,292 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""
+Simulated TiVos for load testing the fleet tools on a single machine.
+
+Every simulated TiVo listens on its own loopback port, or on Linux its own
+loopback address (the whole of 127.0.0.0/8 reaches the local machine), and
+has a channel, live TV mode and response times of its own.
+"""
+
+import asyncio
+import os
+import random
+from collections import deque
+from time import perf_counter
+
+from .fleet import percentiles
+from .fleet_runner import max_rss, raise_fd_limit
+from .inventory import Device, Inventory
+from .protocol import PORT, LineBuffer
+
+class LatencyProfile:
+    """How quickly, and how reliably, a simulated TiVo responds."""
+    def __init__(self, name, delay, jitter, drop_rate=0.0):
+        self.name = name
+
+        # Seconds taken to act on each command, give or take `jitter`.
+        self.delay = delay
+        self.jitter = jitter
+
+        # The chance of a command making the TiVo drop the connection.
+        self.drop_rate = drop_rate
+
+    def sample(self, rng):
+        return max(0.0, self.delay + rng.uniform(-self.jitter, self.jitter))
+
+PROFILES = {
+    "lan"   : LatencyProfile("lan",   0.002, 0.001),
+    "wifi"  : LatencyProfile("wifi",  0.015, 0.010),
+    "slow"  : LatencyProfile("slow",  0.150, 0.100),
+    "flaky" : LatencyProfile("flaky", 0.020, 0.015, drop_rate=0.05)
+}
+
+def parse_profiles(text):
+    """
+    Parses a mix of latency profiles such as "lan:80,wifi:15,slow:5" into a
+    list of (profile, weight).
+    """
+    mix = []
+
+    for part in text.split(","):
+        name, _, weight = part.strip().partition(":")
+
+        if name not in PROFILES:
+            raise ValueError(f"Unknown latency profile {name}, expected one "
+                             f"of {', '.join(PROFILES)}")
+
+        mix.append((PROFILES[name], float(weight or 1)))
+
+    return mix
+
+# Channels in the lineup of every simulated TiVo; others are refused.
+LINEUP = range(1, 1000)
+
+class FleetStats:
+    """Counters shared by every simulated TiVo."""
+    def __init__(self, samples=100000):
+        self.accepted = 0
+        self.open = 0
+        self.commands = 0
+        self.dropped = 0
+
+        # Time taken to respond to the most recent commands, in
+        # milliseconds.
+        self.service_times = deque(maxlen=samples)
+
+class SimulatedTiVo:
+    """A TiVo speaking just enough of the TCP Remote Protocol to test with."""
+    def __init__(self, device, profile, stats, rng):
+        self.device = device
+        self.profile = profile
+        self.stats = stats
+        self.rng = rng
+
+        self.channel = rng.choice(LINEUP)
+        self.live = True
+
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_client,
+                                                 self.device.address,
+                                                 self.device.port)
+
+    def status(self, reason):
+        return f"CH_STATUS {self.channel:04} {reason}"
+
+    def respond(self, command):
+        """Acts on a command, returning the response line if there is one."""
+        data = command.split()
+
+        if not data:
+            return None
+
+        if data[0] in ("SETCH", "FORCECH"):
+            if not self.live:
+                return "CH_FAILED NO_LIVE"
+
+            try:
+                channel = int(data[1])
+            except (IndexError, ValueError):
+                return "CH_FAILED MALFORMED_CHANNEL"
+
+            if channel not in LINEUP:
+                return "CH_FAILED INVALID_CHANNEL"
+
+            self.channel = channel
+            return self.status("REMOTE")
+
+        if data[0] == "TELEPORT" and len(data) > 1:
+            self.live = data[1] == "LIVETV"
+            return "LIVETV_READY" if self.live else None
+
+        if command == "IRCODE LIVETV":
+            self.live = True
+        elif command in ("IRCODE TIVO", "IRCODE GUIDE"):
+            self.live = False
+        elif command in ("IRCODE CHANNELUP", "IRCODE CHANNELDOWN") and \
+             self.live:
+            step = 1 if command == "IRCODE CHANNELUP" else -1
+            self.channel = LINEUP[(LINEUP.index(self.channel) + step) %
+                                  len(LINEUP)]
+            return self.status("LOCAL")
+
+        return None
+
+    async def handle_client(self, reader, writer):
+        self.stats.accepted += 1
+        self.stats.open += 1
+
+        lines = LineBuffer()
+
+        try:
+            # Real TiVos report their channel as soon as we connect.
+            writer.write(self.status("LOCAL").encode('utf-8') + b"\r")
+
+            while True:
+                data = await reader.read(4096)
+
+                if not data:
+                    break
+
+                for line in lines.feed(data):
+                    received = perf_counter()
+
+                    await asyncio.sleep(self.profile.sample(self.rng))
+
+                    if self.rng.random() < self.profile.drop_rate:
+                        self.stats.dropped += 1
+                        return
+
+                    response = self.respond(line)
+
+                    if response:
+                        writer.write(response.encode('utf-8') + b"\r")
+                        await writer.drain()
+
+                    self.stats.commands += 1
+                    self.stats.service_times.append(
+                        (perf_counter() - received) * 1000)
+        except OSError:
+            pass
+        finally:
+            self.stats.open -= 1
+            writer.close()
+
+    def close(self):
+        if self.server:
+            self.server.close()
+
+def device_address(index, base_port, spread):
+    """Returns the (address, port) of the `index`th simulated TiVo."""
+    if spread == "addresses":
+        # Starting at 127.1.0.0 stays well clear of 127.0.0.1, which other
+        # programs are likely to be using.
+        n = 0x010000 + index
+        return f"127.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}", base_port
+
+    return "127.0.0.1", base_port + index
+
+class VirtualFleet:
+    """Any number of simulated TiVos, served from one event loop."""
+    def __init__(self, count, profiles=None, base_port=None,
+                 spread="ports", seed=None):
+        # TiVos on addresses of their own can all use the real port.
+        if base_port is None:
+            base_port = PORT if spread == "addresses" else 41000
+
+        self.rng = random.Random(seed)
+        self.stats = FleetStats()
+
+        mix = profiles or [(PROFILES["lan"], 1.0)]
+        chosen = self.rng.choices([profile for profile, weight in mix],
+                                  [weight for profile, weight in mix],
+                                  k=count)
+
+        self.tivos = []
+
+        for index, profile in enumerate(chosen):
+            address, port = device_address(index, base_port, spread)
+            device = Device(f"virtual-{index:05}-{profile.name}",
+                            address,
+                            port,
+                            tags=("virtual", profile.name))
+
+            # Each TiVo gets its own generator, so that one TiVo's traffic
+            # doesn't change how the others behave for a given seed.
+            self.tivos.append(SimulatedTiVo(device,
+                                            profile,
+                                            self.stats,
+                                            random.Random(self.rng.random())))
+
+        self.started = None
+        self.last_report = None
+
+    async def start(self):
+        raise_fd_limit()
+
+        await asyncio.gather(*(tivo.start() for tivo in self.tivos))
+
+        self.started = perf_counter()
+        self.last_report = (self.started, 0)
+
+    def close(self):
+        for tivo in self.tivos:
+            tivo.close()
+
+    def write_inventory(self, path):
+        """Replaces the inventory at `path` with the simulated TiVos."""
+        inventory = Inventory(path)
+        inventory.replace(tivo.device for tivo in self.tivos)
+        inventory.save()
+
+    def report(self):
+        """
+        Describes the load handled since the last report, and the resources
+        used so far.
+        """
+        now = perf_counter()
+        then, commands = self.last_report
+        self.last_report = (now, self.stats.commands)
+
+        rate = (self.stats.commands - commands) / max(now - then, 1e-9)
+
+        lines = [f"{len(self.tivos)} TiVo(s), {self.stats.open} "
+                 f"connection(s) open, {self.stats.accepted} accepted",
+                 f"{self.stats.commands} command(s), {rate:.0f} per "
+                 f"second, {self.stats.dropped} dropped",
+                 "service time p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms, "
+                 "max {:.1f} ms".format(
+                     *percentiles(self.stats.service_times))]
+
+        resources = []
+        rss = max_rss()
+
+        if rss is not None:
+            resources.append(f"peak memory {rss / 1024:.0f} MiB")
+
+        times = os.times()
+        resources.append(f"CPU {times.user + times.system:.1f} s")
+
+        try:
+            resources.append(f"{len(os.listdir('/proc/self/fd'))} open "
+                             "files")
+        except OSError:
+            pass
+
+        lines.append(", ".join(resources))
+
+        return "\n".join(lines)
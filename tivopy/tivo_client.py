@@ -12,8 +12,12 @@
 # OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
 # PERFORMANCE OF THIS SOFTWARE.
 
-from PySide2.QtCore import QByteArray, QObject, Signal
-from PySide2.QtNetwork import QTcpSocket
+from PySide2.QtCore import QByteArray, QObject, QTimer, Signal
+from PySide2.QtNetwork import QAbstractSocket, QTcpSocket
+
+from .capabilities import Capabilities
+from .device_state import DeviceState
+from .protocol import PORT, LineBuffer, encode_command, parse_response
 
 class TiVoClient(QObject):
     """Implements the TiVo version 1.1 TCP Remote Protocol."""
@@ -21,24 +25,93 @@ class TiVoClient(QObject):
     error_message = Signal(str)
     connection_error = Signal(str)
 
-    def __init__(self, ip):
+    def __init__(self, ip, state=None, capabilities=None):
         super(TiVoClient, self).__init__()
 
+        # Which parts of the protocol the TiVo understands. Commands it
+        # doesn't are rewritten or rejected without a round trip.
+        if capabilities is None:
+            capabilities = Capabilities()
+
+        self.capabilities = capabilities
+
+        # What we know about the TiVo; consulted before sending anything so
+        # that no-op commands never hit the network.
+        self.state = state if state is not None else DeviceState(ip)
+
+        self.ip = ip
+
+        self.lines = LineBuffer()
+
         self.socket = QTcpSocket(self)
 
         # TiVos *always* serve on port 31339. 
-        self.socket.connectToHost(ip, 31339)
+        self.socket.connectToHost(ip, PORT)
 
         self.socket.readyRead.connect(self.handle_read)
 
+    def reconnect(self):
+        """Reopens the connection to the TiVo if it has been lost."""
+        if self.socket.state() != QAbstractSocket.UnconnectedState:
+            return
+
+        # Anything left over from the previous connection is meaningless.
+        self.lines = LineBuffer()
+
+        self.socket.connectToHost(self.ip, PORT)
+
+    def keep_alive(self):
+        """Asks the operating system to detect dead connections for us."""
+        self.socket.setSocketOption(QAbstractSocket.KeepAliveOption, 1)
+
+    def stay_connected(self, interval=2000):
+        """
+        Keeps the connection warm: it's reopened `interval` milliseconds
+        after being lost, until `close()` is called.
+        """
+        self.reconnect_interval = interval
+
+        self.socket.connected.connect(self.keep_alive)
+        self.socket.disconnected.connect(self.schedule_reconnect)
+        self.socket.errorOccurred.connect(self.schedule_reconnect)
+
+    def schedule_reconnect(self, *args):
+        QTimer.singleShot(self.reconnect_interval, self.reconnect)
+
+    def close(self):
+        """Closes the connection for good."""
+        try:
+            self.socket.disconnected.disconnect(self.schedule_reconnect)
+            self.socket.errorOccurred.disconnect(self.schedule_reconnect)
+        except RuntimeError:
+            # stay_connected() was never called.
+            pass
+
+        self.socket.close()
+        self.deleteLater()
+
     def send_command(self, command):
-        print(f'Sending {command}...')
+        """
+        Sends a command to the TiVo. Returns True if it was actually written
+        to the socket.
+        """
+        translated = self.capabilities.translate(command)
+
+        if translated is None:
+            print(f'Not sending {command}, unsupported by this TiVo.')
+            self.error_message.emit("UNSUPPORTED_COMMAND")
+            return False
+
+        command = translated
 
-        # All commands are terminated with a carriage return. The end user
-        # shouldn't have to care about this detail.
-        command += "\r"
+        if self.state.is_redundant(command):
+            print(f'Skipping {command}, already on channel '
+                  f'{self.state.describe_channel()}.')
+            return False
 
-        data = QByteArray(bytes(command, encoding='ascii'))
+        print(f'Sending {command}...')
+
+        data = QByteArray(encode_command(command))
 
         sent_bytes = self.socket.write(data)
         data_len = len(data)
@@ -49,27 +122,25 @@ class TiVoClient(QObject):
                            f"Number of bytes sent: {sent_bytes}\n" \
                            f"Expected: {data_len}"
             self.connection_error.emit(error_string)
+            return False
+
+        self.state.observe_command(command)
+        return True
 
     def handle_read(self):
         """Handles data received by the socket."""
 
-        # Grab the data from the socket.
-        data = self.socket.readAll().data()
-
-        # Remove whitespace from the data.
-        data = data.strip()
-
-        # Convert the data to a string.
-        data = data.decode('utf-8')
-
-        print(f"Received {data}")
+        # Grab the data from the socket. A single read may contain more than
+        # one response, or only part of one.
+        for line in self.lines.feed(self.socket.readAll().data()):
+            print(f"Received {line}")
 
-        # Parameterize the string.
-        data = data.split(' ')
+            response = parse_response(line)
+            self.state.update(response)
 
-        if data[0] == "CH_STATUS":
-            self.channel_changed.emit(data[1])
-        elif data[0] == "CH_FAILED":
-            self.error_message.emit(data[1])
-        else:
-            self.error_message.emit(data[0])
\ No newline at end of file
+            if response.kind == "CH_STATUS":
+                self.channel_changed.emit(self.state.describe_channel())
+            elif response.kind == "CH_FAILED":
+                self.error_message.emit(response.reason)
+            else:
+                self.error_message.emit(response.kind)
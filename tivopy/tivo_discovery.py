@@ -12,45 +12,648 @@
 # OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
 # PERFORMANCE OF THIS SOFTWARE.
 
-from socket import inet_ntoa
-from zeroconf import ServiceBrowser, Zeroconf
+import asyncio
+import ipaddress
+import threading
+from time import monotonic, perf_counter, time
+
+import ifaddr
+from zeroconf import IPVersion, ServiceStateChange, current_time_millis
+from zeroconf.asyncio import (AsyncServiceBrowser,
+                              AsyncServiceInfo,
+                              AsyncZeroconf)
+
+from .capabilities import decode_txt
+from .config import cache_path, load_json, save_json
+from .probe import probe, rank_addresses, scan
+from .ratelimit import TokenBucket
+from .registry import (REMOVED,
+                       DeviceRegistry,
+                       DiscoveredTiVo,
+                       tivo_from_dict,
+                       tivo_to_dict)
+
+# Every service a TiVo advertises, in order of preference when they disagree
+# about its name or properties. Not every TiVo advertises all of them: older
+# models lack mindrpc, and Minis have nothing to share videos from.
+SERVICE_TYPES = ("_tivo-mindrpc._tcp.local.",
+                 "_tivo-remote._tcp.local.",
+                 "_tivo-device._tcp.local.",
+                 "_tivo-videos._tcp.local.")
+
+# Seconds a resolved TiVo is believed for if its records don't say.
+DEFAULT_TTL = 120
+
+# Seconds between checks for TiVos whose records have expired, which is also
+# how often the discovery cache is saved.
+EXPIRY_INTERVAL = 5
+
+# TiVos not seen for this many seconds aren't worth listing at startup.
+MAX_CACHE_AGE = 30 * 24 * 60 * 60
+
+# The most addresses probed at once, and the most probes started a second.
+# Each TiVo has every one of its addresses probed when it's found, and again
+# every PROBE_INTERVAL seconds.
+PROBE_CONCURRENCY = 64
+PROBE_RATE = 50.0
+PROBE_INTERVAL = 60
+
+# Seconds a TiVo that Zeroconf isn't vouching for stays listed once none of
+# its addresses can be reached: those found by scanning, or remembered from
+# the last run. Those Zeroconf found go when their records expire.
+UNREACHABLE_TIMEOUT = 5 * 60
+
+# What TiVoDiscovery raises when Zeroconf can't be started: no usable
+# interfaces, a bad interface address, or sockets that can't be opened.
+START_ERRORS = (OSError, RuntimeError, ValueError)
+
+# TiVos found by scanning rather than Zeroconf have no service name of their
+# own, they're given one made of this and their address.
+SCAN_PREFIX = "scan:"
+
+# The most connections a network scan starts a second. Scans don't go
+# through PROBE_RATE, or a large one would hold up probing the TiVos
+# already found for minutes.
+SCAN_RATE = 1000.0
+
+# The shortest prefix of a network we'll scan, by IP version: 65536
+# addresses, which take a little over a minute at SCAN_RATE.
+MAX_SCAN_PREFIX = { 4 : 16, 6 : 120 }
+
+def instance_name(name, service_type):
+    """
+    Returns the part of a service name shown to the user, such as "Living
+    Room" for "Living Room._tivo-mindrpc._tcp.local.".
+    """
+    suffix = "." + service_type
+
+    if name.endswith(suffix):
+        return name[:-len(suffix)]
+
+    return name
+
+def interface_addresses(interfaces):
+    """
+    Converts a list of interface names and addresses into what Zeroconf
+    wants: IPv4 addresses, and IPv6 interface indexes. Raises ValueError
+    naming any that aren't interfaces or addresses of this machine.
+    """
+    adapters = ifaddr.get_adapters()
+    by_name = {adapter.name : adapter for adapter in adapters}
+
+    # Every address of every interface, IPv6 ones without their scope.
+    addresses = {ip.ip if ip.is_IPv4 else ip.ip[0] : adapter
+                 for adapter in adapters
+                 for ip in adapter.ips}
+
+    result = []
+    unknown = []
+
+    for interface in interfaces:
+        adapter = by_name.get(interface)
+
+        if adapter is not None:
+            for ip in adapter.ips:
+                if ip.is_IPv4:
+                    result.append(ip.ip)
+                elif adapter.index not in result:
+                    result.append(adapter.index)
+
+            continue
+
+        try:
+            address = ipaddress.ip_address(interface)
+        except ValueError:
+            unknown.append(interface)
+            continue
+
+        if str(address) not in addresses:
+            unknown.append(interface)
+        elif address.version == 4:
+            result.append(str(address))
+        elif addresses[str(address)].index not in result:
+            result.append(addresses[str(address)].index)
+
+    if unknown:
+        raise ValueError("no such network interface: " + ", ".join(unknown))
+
+    return result
+
+def scan_network_of(network):
+    """
+    Returns `network` in the form it's scanned and saved in. Raises
+    ValueError if it isn't a network, or is too big to scan.
+    """
+    network = ipaddress.ip_network(network, strict=False)
+
+    if network.prefixlen < MAX_SCAN_PREFIX[network.version]:
+        raise ValueError(f"{network} is too big to scan, the most is a "
+                         f"/{MAX_SCAN_PREFIX[network.version]}")
+
+    return str(network)
+
+def tsn_of(info):
+    """Returns the TSN a service advertises, or None."""
+    return decode_txt(info.properties).get('TSN') or None
+
+def source_order(address):
+    """Sorts IPv4 addresses first, they're what most networks route."""
+    return ipaddress.ip_address(address.split('%')[0]).version
 
 class TiVoDiscovery:
-    """Discovers TiVos on the local network using Zeroconf."""
-    def __init__(self):
-        self.addresses = []
+    """
+    Discovers TiVos on the local network using Zeroconf.
+
+    Everything happens on an event loop in a thread of its own, and TiVos are
+    resolved concurrently, so a TiVo that's slow to answer never holds up
+    the others.
+
+    Each TiVo advertises several services, on every network it's connected
+    to, over IPv4 and IPv6. They're merged into a single entry per TiVo,
+    keyed by its TSN.
+    """
+    def __init__(self, resolve_timeout=3.0, path=None, interfaces=None):
+        # Everything resolved so far: addresses, port and TXT records, which
+        # describe the model and software version. Removals are handled from
+        # here, as a TiVo that has just left the network won't answer any
+        # questions about itself.
+        self.registry = DeviceRegistry()
+
+        # Names or addresses of the network interfaces to look for TiVos
+        # on, or None for all of them. Checked before anything is started.
+        self.interfaces = interfaces
+
+        if interfaces is not None:
+            self.interface_choice = interface_addresses(interfaces)
+
+        # Everything below is only touched on the event loop.
+
+        # Each resolved service by its full name, as a (DiscoveredTiVo.key,
+        # service type, AsyncServiceInfo) tuple.
+        self.services = {}
+
+        # The names of the services resolved for each TiVo.
+        self.service_names = {}
+
+        # Services being resolved right now. The browser reports a service
+        # again for every interface it's seen on, and each record that
+        # changes, none of which needs a second resolution started.
+        self.resolving = set()
+
+        # When the records of each service expire, by monotonic() time.
+        self.expires = {}
+
+        # The keys of TiVos being probed right now.
+        self.probing = set()
+
+        # The longest we wait for a TiVo to answer, in seconds.
+        self.resolve_timeout = resolve_timeout
+
+        # Seconds between starting and the first TiVo being listed.
+        self.started = perf_counter()
+        self.first_listing = None
+
+        self.zeroconf = None
+        self.browser = None
+
+        # The TiVos found last time are listed straight away, unverified,
+        # until discovery or a probe confirms they're still there.
+        self.path = path or cache_path('discovery.json')
+        self.cached = self.load()
+        self.dirty = False
+
+        for tivo in self.cached:
+            self.registry.put(tivo)
+
+        self.registry.listeners.append(self.registry_changed)
+
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+
+        # Whatever stopped Zeroconf from starting, raised again here.
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run,
+                                       name="TiVoDiscovery",
+                                       daemon=True)
+        self.thread.start()
+
+        # Nothing can be closed until it's been opened.
+        self.ready.wait()
+
+        if self.error is not None:
+            self.thread.join()
+            raise self.error
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+
+        try:
+            self.loop.run_until_complete(self.start())
+        except Exception as e:
+            self.error = e
+
+            if self.zeroconf is not None:
+                self.loop.run_until_complete(self.zeroconf.async_close())
+
+            self.loop.close()
+            self.ready.set()
+            return
+
+        self.ready.set()
+        self.loop.run_forever()
+
+    async def start(self):
+        # Zeroconf has to be started from a coroutine. Otherwise it doesn't
+        # see our loop running, and starts one of its own in another thread.
+        if self.interfaces is None:
+            self.zeroconf = AsyncZeroconf(ip_version=IPVersion.All)
+        else:
+            self.zeroconf = AsyncZeroconf(self.interface_choice)
+
+        self.browser = AsyncServiceBrowser(self.zeroconf.zeroconf,
+                                           list(SERVICE_TYPES),
+                                           handlers=[self.state_changed])
+        self.expiry = self.loop.create_task(self.expire())
+
+        self.probe_slots = asyncio.Semaphore(PROBE_CONCURRENCY)
+        self.probe_bucket = TokenBucket(PROBE_RATE)
+        self.reprobing = self.loop.create_task(self.reprobe())
+
+        # Starting with the TiVos remembered from the last run, which are
+        # dropped if they can't be reached.
+        for tivo in self.registry.snapshot:
+            self.probe_changed(tivo)
+
+    def close(self):
+        """Stops discovering TiVos, and waits for the thread to finish."""
+        async def shutdown():
+            await self.browser.async_cancel()
+            await self.zeroconf.async_close()
+
+            # Expiry, probes, and any resolutions or scans still in
+            # progress.
+            tasks = [task for task in asyncio.all_tasks()
+                     if task is not asyncio.current_task()]
+
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        future = asyncio.run_coroutine_threadsafe(shutdown(), self.loop)
+
+        try:
+            future.result(self.resolve_timeout)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+        self.save()
+
+    def load(self):
+        """Returns the TiVos saved by the last run, as unverified."""
+        tivos = []
+        oldest = time() - MAX_CACHE_AGE
+
+        for data in load_json(self.path, []):
+            try:
+                tivo = tivo_from_dict(data)._replace(verified=False,
+                                                     latencies=None)
+            except (KeyError, TypeError):
+                continue
+
+            if (tivo.last_seen or 0) >= oldest:
+                tivos.append(tivo)
+
+        if tivos:
+            print(f"Listed {len(tivos)} TiVo(s) from the last run.")
+
+        return tivos
+
+    def save(self):
+        """Saves the TiVos currently listed, for the next run."""
+        if not self.dirty:
+            return
 
-        self.zeroconf = Zeroconf()
-        self.browser = ServiceBrowser(self.zeroconf,
-                                      "_tivo-mindrpc._tcp.local.",
-                                      self)
-    
-    def remove_service(self, zeroconf, type, name):
+        self.dirty = False
+
+        data = [tivo_to_dict(tivo) for tivo in self.registry.snapshot]
+
+        try:
+            save_json(self.path, data)
+        except OSError as e:
+            print(f"Unable to save {self.path}: {e}")
+
+    def scan(self, network):
+        """
+        Scans `network` (such as "192.168.1.0/24") for TiVos, for when
+        multicast doesn't get through. May be called from any thread.
+        Returns the network as given by scan_network_of(), which raises
+        ValueError if it can't be scanned.
+        """
+        network = scan_network_of(network)
+
+        asyncio.run_coroutine_threadsafe(self.scan_network(network),
+                                         self.loop)
+        return network
+
+    async def scan_network(self, network):
+        def found(address, rtt):
+            # Zeroconf knows better.
+            if self.registry.snapshot.find(address):
+                return
+
+            self.registry.put(DiscoveredTiVo(SCAN_PREFIX + address,
+                                             address,
+                                             (address,),
+                                             None,
+                                             {},
+                                             True,
+                                             time(),
+                                             rtt,
+                                             { address : rtt }))
+
+        start = perf_counter()
+        hits = await scan(network, found, SCAN_RATE)
+
+        print(f"Scanned {network} in {perf_counter() - start:.2f} s, found "
+              f"{len(hits)} TiVo(s).")
+
+    def registry_changed(self, event, tivo):
+        self.dirty = True
+
+        if event != REMOVED:
+            self.loop.call_soon_threadsafe(self.probe_changed, tivo)
+
+    def probe_changed(self, tivo):
+        """Probes a TiVo that has addresses we haven't probed yet."""
+        if tivo.latencies is None or \
+           not set(tivo.addresses).issubset(tivo.latencies):
+            self.loop.create_task(self.probe_tivo(tivo.key))
+
+    async def reprobe(self):
+        """Probes every TiVo again now and then, as they come and go."""
+        while True:
+            await asyncio.sleep(PROBE_INTERVAL)
+
+            for tivo in self.registry.snapshot:
+                self.loop.create_task(self.probe_tivo(tivo.key))
+
+    async def probe_address(self, address):
+        async with self.probe_slots:
+            await self.probe_bucket.acquire()
+            return await probe(address, timeout=self.resolve_timeout)
+
+    async def probe_tivo(self, key):
+        """
+        Measures how long each address of a TiVo takes to connect to, all at
+        once, and puts the fastest first. TiVos remembered from the last run
+        are dropped if none of their addresses can be reached, as are other
+        TiVos Zeroconf doesn't know of once they've been unreachable for
+        UNREACHABLE_TIMEOUT.
+        """
+        if key in self.probing:
+            return
+
+        self.probing.add(key)
+        latencies = {}
+
+        try:
+            while True:
+                tivo = self.registry.snapshot.get(key)
+
+                if tivo is None:
+                    return
+
+                # Discovery may have found more addresses in the meantime.
+                addresses = [address for address in tivo.addresses
+                             if address not in latencies]
+
+                if not addresses:
+                    break
+
+                rtts = await asyncio.gather(*(self.probe_address(address)
+                                              for address in addresses))
+                latencies.update(zip(addresses, rtts))
+        finally:
+            self.probing.discard(key)
+
+        reachable = [rtt for rtt in latencies.values() if rtt is not None]
+
+        if not reachable and \
+           (not tivo.verified or
+            (key not in self.service_names and
+             time() - (tivo.last_seen or 0) > UNREACHABLE_TIMEOUT)):
+            print(f"{tivo.name} is no longer reachable.")
+            self.registry.remove(key)
+            return
+
+        latencies = { address : latencies[address]
+                      for address in tivo.addresses }
+
+        self.registry.put(tivo._replace(
+            addresses=rank_addresses(tivo.addresses, latencies),
+            verified=True,
+            last_seen=time() if reachable else tivo.last_seen,
+            rtt=min(reachable, default=None),
+            latencies=latencies))
+
+    def state_changed(self, zeroconf, service_type, name, state_change):
+        """
+        Called by the browser on the event loop whenever a TiVo appears,
+        changes or disappears. This must never block.
+        """
+        if state_change is ServiceStateChange.Removed:
+            self.remove_service(name)
+        elif name not in self.resolving:
+            self.resolving.add(name)
+            asyncio.ensure_future(self.resolve(service_type, name))
+
+    def remove_service(self, name):
+        """Called when a service has been removed from the network."""
+        self.expires.pop(name, None)
+        service = self.services.pop(name, None)
+
+        if service is None:
+            return
+
+        key = service[0]
+        names = self.service_names[key]
+        names.discard(name)
+
+        # The TiVo is only gone once all of its services are.
+        if names:
+            self.merge(key)
+        else:
+            del self.service_names[key]
+            self.registry.remove(key)
+
+    def remaining_ttl(self, name):
+        """
+        Returns how many more seconds Zeroconf's cached records for a service
+        are good for, without asking the network.
+        """
+        now = current_time_millis()
+        cache = self.zeroconf.zeroconf.cache
+
+        return max((record.get_remaining_ttl(now)
+                    for record in cache.async_entries_with_name(name)),
+                   default=0)
+
+    async def expire(self):
+        """Forgets services whose records have expired."""
+        while True:
+            await asyncio.sleep(EXPIRY_INTERVAL)
+
+            now = monotonic()
+
+            for name, expires in list(self.expires.items()):
+                if expires > now:
+                    continue
+
+                # The records may well have been refreshed since we resolved
+                # them, in which case the TiVo is still there.
+                ttl = self.remaining_ttl(name)
+
+                if ttl > 0:
+                    self.expires[name] = now + ttl
+                else:
+                    print(f"{name} expired.")
+                    self.remove_service(name)
+
+            self.save()
+
+    def key_of(self, info, addresses):
         """
-        Called by zeroconf.ServiceBrowser when a TiVo has been removed from
-        the network.
+        Works out which TiVo a service belongs to: the one with its TSN, or
+        failing that, one with any of the same addresses.
         """
-        info = zeroconf.get_service_info(type, name)
+        tsn = tsn_of(info)
+
+        if tsn:
+            return tsn
 
-        for address in info.addresses:
-            # The user should not care about the underlying service name.
-            result = (name.strip('._tivo-mindrpc._tcp.local.'),
-                      inet_ntoa(address))
+        for address in addresses:
+            for key, service_type, other in self.services.values():
+                if address in other.parsed_scoped_addresses():
+                    return key
 
-            if result in self.addresses:
-                self.addresses.remove(result)
+        return info.name
 
-    def add_service(self, zeroconf, type, name):
+    def adopt(self, key, addresses):
         """
-        Called by zeroconf.ServiceBrowser when a TiVo has been detected on the
-        network.
+        Moves the services of any TiVo known only by name, at any of
+        `addresses`, under `key`: the TSN that has just turned up for it.
         """
-        info = zeroconf.get_service_info(type, name)
+        for other, names in list(self.service_names.items()):
+            infos = [self.services[name][2] for name in names]
+
+            if other == key or any(tsn_of(info) for info in infos):
+                continue
+
+            if not any(address in info.parsed_scoped_addresses()
+                       for info in infos
+                       for address in addresses):
+                continue
+
+            del self.service_names[other]
+            self.service_names[key].update(names)
+
+            for name in names:
+                _, service_type, info = self.services[name]
+                self.services[name] = (key, service_type, info)
+
+            self.registry.remove(other)
+
+    async def resolve(self, service_type, name):
+        """Looks up the addresses and TXT records of a service."""
+        try:
+            info = AsyncServiceInfo(service_type, name)
+
+            if not await info.async_request(self.zeroconf.zeroconf,
+                                            self.resolve_timeout * 1000):
+                print(f"{name} didn't answer within "
+                      f"{self.resolve_timeout} s.")
+                return
+        finally:
+            self.resolving.discard(name)
+
+        addresses = info.parsed_scoped_addresses()
+
+        if not addresses:
+            return
+
+        key = self.key_of(info, addresses)
+        previous = self.services.get(name)
+
+        # A TiVo that has only just advertised its TSN, say.
+        if previous and previous[0] != key:
+            self.remove_service(name)
+
+        self.services[name] = (key, service_type, info)
+        self.service_names.setdefault(key, set()).add(name)
+
+        if tsn_of(info):
+            self.adopt(key, addresses)
+        self.expires[name] = \
+            monotonic() + (self.remaining_ttl(name) or DEFAULT_TTL)
+
+        self.merge(key)
+
+        if self.first_listing is None:
+            self.first_listing = perf_counter() - self.started
+            print(f"First TiVo listed after {self.first_listing * 1000:.0f} "
+                  "ms.")
+
+    def merge(self, key):
+        """Combines the services of a TiVo into a single registry entry."""
+        services = sorted((self.services[name]
+                           for name in self.service_names[key]),
+                          key=lambda service:
+                              SERVICE_TYPES.index(service[1]))
+
+        addresses = []
+        properties = {}
+
+        for _, service_type, info in services:
+            for address in info.parsed_scoped_addresses():
+                if address not in addresses:
+                    addresses.append(address)
+
+            # The preferred service has the last word.
+            properties = {**info.properties, **properties}
+
+        addresses.sort(key=source_order)
+
+        # Whatever has been learnt about them by probing still holds.
+        previous = self.registry.snapshot.get(key)
+        latencies = None
+
+        if previous and previous.latencies is not None:
+            latencies = { address : previous.latencies[address]
+                          for address in addresses
+                          if address in previous.latencies }
+            addresses = rank_addresses(addresses, latencies)
+
+        # Whatever was found by scanning these addresses, or remembered
+        # from the last run under another key, is this TiVo.
+        for address in addresses:
+            found = self.registry.snapshot.find(address)
+
+            if found and found.key != key and \
+               found.key not in self.service_names:
+                self.registry.remove(found.key)
 
-        for address in info.addresses:
-            # The user should not care about the underlying service name.
-            result = (name.strip('._tivo-mindrpc._tcp.local.'),
-                      inet_ntoa(address))
+        _, service_type, info = services[0]
 
-            if result not in self.addresses:
-                self.addresses.append(result)
\ No newline at end of file
+        self.registry.put(DiscoveredTiVo(key,
+                                         instance_name(info.name,
+                                                       service_type),
+                                         tuple(addresses),
+                                         info.port,
+                                         properties,
+                                         True,
+                                         time(),
+                                         previous.rtt if previous else None,
+                                         latencies))
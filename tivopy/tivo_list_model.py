@@ -0,0 +1,155 @@
+# Copyright 2020 Michael Rodriguez
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+from PySide2.QtCore import (QAbstractTableModel,
+                            QModelIndex,
+                            QSortFilterProxyModel,
+                            Qt)
+from PySide2.QtGui import QPalette
+from PySide2.QtWidgets import QApplication
+
+def format_rtt(rtt):
+    return "" if rtt is None else f"{rtt * 1000:.0f} ms"
+
+def reachability(tivo):
+    """Returns whether a TiVo can be connected to, as shown to the user."""
+    # TiVos remembered from the last run might not be there anymore.
+    if not tivo.verified:
+        return "unverified"
+
+    if tivo.latencies is None:
+        return "checking"
+
+    return "yes" if tivo.rtt is not None else "no"
+
+def rank(tivo):
+    """Sorts TiVos that answered quickly first, and unreachable ones last."""
+    if tivo.rtt is not None:
+        return (0, tivo.rtt, tivo.name)
+
+    if tivo.latencies is None:
+        return (1, 0, tivo.name)
+
+    return (2, 0, tivo.name)
+
+class TiVoListModel(QAbstractTableModel):
+    """
+    The discovered TiVos, one row each. Changes are applied one TiVo at a
+    time, so that views keep their selection and scroll position.
+    """
+    HEADERS = ["Name", "IP Address", "Reachable", "Latency"]
+
+    def __init__(self, parent=None):
+        super(TiVoListModel, self).__init__(parent)
+
+        # In the order they were found.
+        self.tivos = []
+
+        # DiscoveredTiVo.key to row numbers.
+        self.rows = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.tivos)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        tivo = self.tivos[index.row()]
+
+        if role == Qt.DisplayRole:
+            if index.column() == 0:
+                return tivo.name
+
+            if index.column() == 1:
+                return tivo.addresses[0] if tivo.addresses else ""
+
+            if index.column() == 2:
+                return reachability(tivo)
+
+            return format_rtt(tivo.rtt)
+
+        if role == Qt.ToolTipRole:
+            latencies = tivo.latencies or {}
+
+            return "\n".join(f"{address}\t"
+                             f"{format_rtt(latencies.get(address))}"
+                             for address in tivo.addresses)
+
+        if role == Qt.ForegroundRole and \
+           (not tivo.verified or reachability(tivo) == "no"):
+            return QApplication.palette().brush(QPalette.Disabled,
+                                                QPalette.Text)
+
+        return None
+
+    def tivo(self, row):
+        return self.tivos[row]
+
+    def update_tivo(self, tivo):
+        """Adds a TiVo, or updates its row if it's already listed."""
+        row = self.rows.get(tivo.key)
+
+        if row is not None:
+            self.tivos[row] = tivo
+            self.dataChanged.emit(self.index(row, 0),
+                                  self.index(row, len(self.HEADERS) - 1))
+            return
+
+        row = len(self.tivos)
+
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.tivos.append(tivo)
+        self.rows[tivo.key] = row
+        self.endInsertRows()
+
+    def remove_tivo(self, tivo):
+        row = self.rows.pop(tivo.key, None)
+
+        if row is None:
+            return
+
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.tivos[row]
+
+        for moved in self.tivos[row:]:
+            self.rows[moved.key] -= 1
+
+        self.endRemoveRows()
+
+class RankedTiVos(QSortFilterProxyModel):
+    """
+    The discovered TiVos, fastest to connect to first. Rows move as probes
+    finish.
+    """
+    def __init__(self, source, parent=None):
+        super(RankedTiVos, self).__init__(parent)
+
+        self.setSourceModel(source)
+        self.setDynamicSortFilter(True)
+        self.sort(0)
+
+    def lessThan(self, left, right):
+        source = self.sourceModel()
+
+        return rank(source.tivo(left.row())) < rank(source.tivo(right.row()))
@@ -12,13 +12,25 @@
 # OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
 # PERFORMANCE OF THIS SOFTWARE.
 
-from PySide2.QtCore import QObject, QTimer, Slot
+from PySide2.QtCore import QObject, Qt, QTimer, Slot
 from PySide2.QtWidgets import QInputDialog, QLineEdit, QMessageBox
 
+from .broadcast import Broadcast
+from .capabilities import Capabilities, CapabilityCache, decode_txt
+from .config import config_path, load_json, save_json
 from .change_channel import ChangeChannel
+from .device_state import DeviceStates
+from .discovery_events import DiscoveryEvents
+from .discovery_service import open_discovery
+from .groups import DeviceGroups
+from .instance_server import InstanceServer
+from .inventory import DISCOVERED, STATIC, Inventory
 from .main_window import MainWindow
+from .mirror import Mirror
+from .select_followers import SelectFollowers
+from .send_to_group import SendToGroup
 from .select_tivo import SelectTiVoWidget
-from .tivo_discovery import TiVoDiscovery
+from .tivo_discovery import START_ERRORS
 from .tivo_client import TiVoClient
 
 class TiVoPy(QObject):
@@ -30,6 +42,71 @@ class TiVoPy(QObject):
         # but it doesn't actually exist yet.
         self.main_window = None
 
+        # Not connected to a TiVo until one has been selected.
+        self.client = None
+
+        # The last known state of every TiVo we've connected to, this allows
+        # us to answer "what channel is it on?" without a round trip.
+        self.device_states = DeviceStates()
+
+        # What each TiVo is capable of, detected once and kept on disk.
+        self.capabilities = CapabilityCache()
+
+        # Every TiVo we've seen, used by the headless fleet tools.
+        self.inventory = Inventory()
+
+        # Saves the inventory once discovery has settled down, rather than
+        # after every change, as the whole file is written each time.
+        self.inventory_timer = QTimer(self)
+        self.inventory_timer.setSingleShot(True)
+        self.inventory_timer.setInterval(2000)
+        self.inventory_timer.timeout.connect(self.inventory.save)
+
+        # Named groups of TiVos, and the persistent connections used to
+        # control them all at once.
+        self.groups = DeviceGroups()
+        self.broadcast = Broadcast(self.device_states, self.capabilities)
+        self.broadcast.finished.connect(self.broadcast_finished)
+
+        # Other TiVos following the channel of the one we're connected to.
+        self.mirror = None
+
+        # Networks scanned for TiVos whenever we look for them, for when
+        # multicast doesn't reach them.
+        self.scan_path = config_path('scan.json')
+        self.scan_networks = load_json(self.scan_path, [])
+
+        # Network interfaces to look for TiVos on, for hosts connected to
+        # networks that have nothing to do with TiVos. All of them if there
+        # aren't any.
+        self.interfaces = load_json(config_path('interfaces.json'), [])
+
+        # TiVos are discovered for as long as we run, through the discovery
+        # service shared with any other TiVoPy processes.
+        try:
+            self.tivo_discovery = open_discovery(self.interfaces or None)
+        except START_ERRORS as e:
+            QMessageBox.critical(None, "Error",
+                                 f"Unable to look for TiVos: {e}")
+            raise SystemExit(1)
+
+        # Later invocations of TiVoPy forward their commands to us rather
+        # than starting up all over again.
+        self.instance_server = InstanceServer(self.forwarded_command)
+        self.instance_server.show_requested.connect(self.show_window)
+
+        # TiVos are listed the moment they're found. Discovery happens on a
+        # thread of its own, so the signals are queued for the GUI thread.
+        self.discovery_events = DiscoveryEvents(self.tivo_discovery.registry)
+        self.discovery_events.added.connect(self.tivo_found,
+                                            Qt.QueuedConnection)
+        self.discovery_events.updated.connect(self.tivo_found,
+                                              Qt.QueuedConnection)
+        self.discovery_events.removed.connect(self.tivo_lost,
+                                              Qt.QueuedConnection)
+
+        self.select_tivo_widget = None
+
         # The first thing we do is allow the user to select a TiVo to connect
         # to. This will govern the rest of the program startup routine.
         self.select_tivo()
@@ -40,18 +117,53 @@ class TiVoPy(QObject):
         Called at either program startup to select a TiVo or when the user
         wishes to change to a different TiVo.
         """
-        self.tivo_discovery = TiVoDiscovery()
-
         self.select_tivo_widget = SelectTiVoWidget()
         self.select_tivo_widget.connect_to_tivo.connect(self.connect_to_tivo)
+        self.select_tivo_widget.scan_requested.connect(self.scan_network)
 
-        # Discover TiVos on the local network every 5 seconds.
-        self.discovery_timer = QTimer(self)
-        self.discovery_timer.timeout.connect(self.discover_tivos)
-        self.discovery_timer.start(5000)
+        # Everything found so far; changes from here on arrive as signals.
+        for tivo in self.tivo_discovery.registry.snapshot:
+            self.tivo_found(tivo)
+
+        for network in self.scan_networks:
+            try:
+                self.tivo_discovery.scan(network)
+            except ValueError as e:
+                print(f"Not scanning {network}: {e}")
 
         self.select_tivo_widget.show()
 
+    @Slot()
+    def close(self):
+        """Called when the program is about to exit."""
+        self.instance_server.close()
+
+        # Leaves the discovery service running for a while, so that what
+        # was discovered is listed straight away next time.
+        self.discovery_events.close()
+        self.tivo_discovery.close()
+
+        if self.inventory_timer.isActive():
+            self.inventory_timer.stop()
+            self.inventory.save()
+
+    @Slot(str)
+    def scan_network(self, network):
+        """Called when the user wants a network scanned for TiVos."""
+        try:
+            network = self.tivo_discovery.scan(network)
+        except ValueError as e:
+            QMessageBox.critical(self.select_tivo_widget, "Error", str(e))
+            return
+
+        if network not in self.scan_networks:
+            self.scan_networks.append(network)
+
+            try:
+                save_json(self.scan_path, self.scan_networks)
+            except OSError as e:
+                print(f"Unable to save {self.scan_path}: {e}")
+
     @Slot(str)
     def send_command(self, command):
         """
@@ -59,12 +171,58 @@ class TiVoPy(QObject):
         """
         self.client.send_command(command)
 
+    def forwarded_command(self, command):
+        """
+        Called when another invocation of TiVoPy has forwarded a command to
+        us. Returns an error code, or None if the command was accepted.
+        """
+        if not self.client:
+            return "NOT_CONNECTED"
+
+        # The protocol is ASCII only, anything else can't even be sent.
+        if not command.isascii():
+            return "INVALID_COMMAND"
+
+        # Unsupported by this TiVo, already done, or lost to a network
+        # error, which have been reported here.
+        if not self.client.send_command(command):
+            return "NOT_SENT"
+
+    @Slot()
+    def show_window(self):
+        """Called when the user has tried to start TiVoPy a second time."""
+        window = self.main_window
+
+        if not window or not window.isVisible():
+            window = self.select_tivo_widget
+
+        window.show()
+        window.raise_()
+        window.activateWindow()
+
     @Slot(str, str)
     def connect_to_tivo(self, name, ip_address):
         """Called when the user wants to connect to a TiVo."""
-        self.discovery_timer.stop()
+        # Discovered TiVos advertise their model in their TXT records, which
+        # is cached for the next time we connect to this address.
+        properties = self.discovered_properties(ip_address)
+
+        if properties:
+            self.capabilities.store(ip_address,
+                                    Capabilities.from_txt(properties))
+
+        self.remember_tivo(name, [ip_address], properties)
+
+        # Followers were following the TiVo we were connected to, whose
+        # connection is of no further use.
+        self.stop_mirroring()
 
-        self.client = TiVoClient(ip_address)
+        if self.client:
+            self.client.close()
+
+        self.client = TiVoClient(ip_address,
+                                 self.device_states.get(ip_address),
+                                 self.capabilities.get(ip_address))
         self.client.socket.errorOccurred.connect(self.socket_error)
         self.client.error_message.connect(self.error_message)
         self.client.channel_changed.connect(self.channel_changed)
@@ -78,10 +236,18 @@ class TiVoPy(QObject):
             self.main_window.select_tivo.triggered.connect(self.select_tivo)
             self.main_window.input_text.triggered.connect(self.input_text)
             self.main_window.change_channel.triggered.connect(self.change_channel)
+            self.main_window.send_to_group.triggered.connect(
+                self.select_group)
+            self.main_window.mirror_tivo.triggered.connect(
+                self.select_followers)
+            self.main_window.stop_mirroring.triggered.connect(
+                self.stop_mirroring)
+            self.main_window.command_requested.connect(self.send_command)
 
         self.main_window.setWindowTitle(f"TiVoPy - {name} ({ip_address})")
 
-        self.main_window.command_requested.connect(self.send_command)
+        # We may have been connected to this TiVo before.
+        self.main_window.update_channel(self.client.state.describe_channel())
 
         self.select_tivo_widget.close()
         self.main_window.show()
@@ -95,6 +261,8 @@ class TiVoPy(QObject):
             text = "The DVR is not in live TV mode."
         elif error == "INVALID_CHANNEL":
             text = "Channel not found in TCD lineup."
+        elif error == "UNSUPPORTED_COMMAND":
+            text = "This TiVo does not support that command."
         else:
             text = f'{error} reached.'
 
@@ -122,6 +290,94 @@ class TiVoPy(QObject):
         else:
             self.client.send_command(f"SETCH {channel}")
 
+    @Slot()
+    def select_group(self):
+        """
+        Called when the user wishes to send a command or macro to a group of
+        TiVos at once.
+        """
+        # Warm up the connections while the user is still typing, the first
+        # send would otherwise have to wait for every TiVo to connect.
+        for name in self.groups.names():
+            self.broadcast.connect_to(self.groups.get(name))
+
+        self.send_to_group_widget = SendToGroup(self.groups)
+        self.send_to_group_widget.send_to_group.connect(self.send_to_group)
+        self.send_to_group_widget.show()
+
+    @Slot(str, list, list)
+    def send_to_group(self, name, addresses, commands):
+        """Called when the user has picked a group and what to send it."""
+        self.groups.set(name, addresses)
+        self.broadcast.send(addresses, commands)
+
+    @Slot(object)
+    def broadcast_finished(self, report):
+        """Reports the outcome of sending to a group to the user."""
+        print(report)
+
+        if report.failures:
+            QMessageBox.warning(self.main_window, "Send to group", str(report))
+        else:
+            QMessageBox.information(self.main_window,
+                                    "Send to group",
+                                    str(report))
+
+    @Slot()
+    def select_followers(self):
+        """
+        Called when the user wishes other TiVos to follow the channel of the
+        one we're connected to.
+        """
+        self.select_followers_widget = \
+            SelectFollowers(self.tivo_discovery.registry.snapshot.listings())
+        self.select_followers_widget.followers_selected.connect(
+            self.start_mirroring)
+        self.select_followers_widget.show()
+
+    @Slot(list)
+    def start_mirroring(self, addresses):
+        """Called when the user has selected the TiVos to mirror to."""
+        self.stop_mirroring()
+
+        if not addresses:
+            return
+
+        self.mirror = Mirror(self.client,
+                             addresses,
+                             self.device_states,
+                             self.capabilities)
+        self.mirror.propagated.connect(
+            lambda ip, delay: self.update_mirror_status())
+        self.mirror.failed.connect(
+            lambda ip, error: self.update_mirror_status())
+
+        self.update_mirror_status()
+
+    @Slot()
+    def stop_mirroring(self):
+        """Called when mirror mode should end."""
+        if not self.mirror:
+            return
+
+        self.mirror.stop()
+        self.mirror = None
+
+        self.main_window.update_mirror_status(None)
+
+    @Slot()
+    def update_mirror_status(self):
+        """Reports the propagation delays of mirror mode to the user."""
+        report = self.mirror.report()
+
+        worst = [delay for count, mean, delay in report.values() if count]
+        status = f"Mirroring to {len(report)} TiVo(s)"
+
+        if worst:
+            status += f", slowest follower: {max(worst):.0f} ms"
+
+        self.main_window.update_mirror_status(status)
+
     @Slot()
     def socket_error(self):
         QMessageBox.critical(self.main_window,
@@ -143,12 +399,37 @@ class TiVoPy(QObject):
     def connection_error(self, error_string):
         QMessageBox.warning(self.main_window, "Network error", error_string)
 
-    def discover_tivos(self):
+    @Slot(object)
+    def tivo_found(self, tivo):
+        """Called when a TiVo has been discovered, or has changed."""
+        self.select_tivo_widget.update_tivo(tivo)
+        self.remember_tivo(tivo.name, tivo.addresses, tivo.properties)
+
+    @Slot(object)
+    def tivo_lost(self, tivo):
+        """Called when a TiVo has left the network."""
+        self.select_tivo_widget.remove_tivo(tivo)
+
+    def discovered_properties(self, ip_address):
+        """Returns the TXT records of a discovered TiVo, or None."""
+        tivo = self.tivo_discovery.registry.snapshot.find(ip_address)
+
+        return tivo.properties if tivo else None
+
+    def remember_tivo(self, name, ip_addresses, properties):
         """
-        Called every 5 seconds to add newly discovered TiVos to the select TiVo
-        widget list.
+        Merges a TiVo into the inventory, along with its model and TSN if it
+        was discovered, and saves it shortly if anything changed.
         """
-        self.select_tivo_widget.tivo_listings.clear()
-    
-        for name, ip_address in self.tivo_discovery.addresses:
-            self.select_tivo_widget.add_tivo(name, ip_address)
+        model = tsn = None
+
+        if properties:
+            model = Capabilities.from_txt(properties).model
+            tsn = decode_txt(properties).get('TSN')
+
+        # TiVos without a name were entered by hand.
+        origin = STATIC if name == "unknown" else DISCOVERED
+
+        if self.inventory.merge(name, list(ip_addresses), model=model,
+                                device_id=tsn, origin=origin):
+            self.inventory_timer.start()